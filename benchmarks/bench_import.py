@@ -0,0 +1,45 @@
+'''Import time of the package modules in a fresh interpreter, with a budget per module.
+The parse/mapping layer must import without MDAnalysis, pandas is loaded on first use.'''
+import os
+import sys
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# seconds, on top of the interpreter start-up
+PARSE_LAYER = ['string_process', 'iupac_converter', 'glycan_tree', 'mapping_cache', 'batch_mapping']
+BUDGET = dict({module: 0.3 for module in PARSE_LAYER}, compute_torsions=0.5)
+
+SCRIPT = '''
+import sys
+from time import perf_counter
+start = perf_counter()
+import iupac_to_mapping.{module}
+seconds = perf_counter() - start
+loaded = [name for name in ('MDAnalysis', 'pandas', 'numba')
+          if name in sys.modules and type(sys.modules[name]).__name__ != '_LazyModule']
+print(seconds, ' '.join(loaded))
+'''
+
+
+def import_time(module):
+    '''returns the seconds to import iupac_to_mapping.module in a new interpreter and the heavy
+    dependencies it actually loaded.'''
+    output = subprocess.run([sys.executable, '-c', SCRIPT.format(module=module)], cwd=ROOT,
+                            capture_output=True, text=True, check=True).stdout.split()
+    return float(output[0]), output[1:]
+
+
+class TrackImportTime:
+    params = (sorted(BUDGET),)
+    param_names = ['module']
+    unit = 'seconds'
+    budget = BUDGET
+
+    def track_import_seconds(self, module):
+        seconds, loaded = import_time(module)
+        if module in PARSE_LAYER and 'MDAnalysis' in loaded:
+            raise AssertionError(f'iupac_to_mapping.{module} imports MDAnalysis')
+        if loaded:
+            raise AssertionError(f"iupac_to_mapping.{module} loads {', '.join(loaded)} at import")
+        return seconds
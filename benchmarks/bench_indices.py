@@ -0,0 +1,18 @@
+'''GlycanStructure.find_indices on synthetic glycoprotein topologies with 5 to 500 glycosylation sites.'''
+import MDAnalysis as mda
+from synthetic import glycoprotein
+from iupac_to_mapping import glycan_chain_indices
+
+CORE = ['BGLCN', 'BGLCN', 'BMAN']
+
+
+class TimeFindIndices:
+    params = ([5, 50, 500],)
+    param_names = ['n_sites']
+
+    def setup(self, n_sites):
+        topology = glycoprotein(n_sites)[0]
+        self.glycans = mda.Universe(topology).select_atoms('not resname ALA and not resname ASN')
+
+    def time_find_indices(self, n_sites):
+        glycan_chain_indices.GlycanStructure(self.glycans, CORE).find_indices()
@@ -0,0 +1,98 @@
+'''Dihedral kernel against the per-AtomGroup approach (AtomGroup.dihedral.value() per dihedral and frame)
+at 10^3 to 10^6 dihedral-frames, run directly for a comparison table:
+    python benchmarks/bench_kernel.py'''
+import sys
+import os
+from time import perf_counter
+import numpy as np
+import MDAnalysis as mda
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from iupac_to_mapping import dihedral_kernel
+
+N_DIHEDRALS = 100
+BOX = np.array([50.0, 50.0, 50.0, 90.0, 90.0, 90.0])
+
+
+def kernel_input(n_dihedral_frames, n_dihedrals=N_DIHEDRALS, seed=0):
+    '''Deterministic coordinates (n_frames x 4*n_dihedrals x 3) of n_dihedrals independent four-atom
+    chains with 1.5 A bonds, wrapped into BOX so some of them are split across the periodic boundary,
+    and their quadruplets, n_frames = n_dihedral_frames / n_dihedrals.'''
+    rng = np.random.default_rng(seed)
+    n_frames = max(1, n_dihedral_frames // n_dihedrals)
+    bonds = rng.normal(size=(n_frames, n_dihedrals, 4, 3))
+    bonds *= 1.5 / np.linalg.norm(bonds, axis=-1, keepdims=True)
+    bonds[:, :, 0] = rng.uniform(0, BOX[0], size=(n_frames, n_dihedrals, 3))
+    positions = (np.cumsum(bonds, axis=2) % BOX[:3]).reshape(n_frames, -1, 3).astype(np.float32)
+    quadruplets = np.arange(4 * n_dihedrals).reshape(-1, 4)
+    return positions, quadruplets
+
+
+def atomgroup_universe(positions):
+    '''Universe over the kernel_input coordinates, read from memory.'''
+    u = mda.Universe.empty(positions.shape[1], trajectory=True)
+    u.load_new(positions, order='fac', dimensions=BOX)
+    return u
+
+
+def atomgroup_dihedrals(u, quadruplets):
+    groups = [u.atoms[q] for q in quadruplets]
+    return np.array([[ag.dihedral.value() for ag in groups] for ts in u.trajectory])
+
+
+class TimeDihedralKernel:
+    params = ([10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6],)
+    param_names = ['n_dihedral_frames']
+
+    def setup(self, n):
+        self.positions, self.quadruplets = kernel_input(n)
+        if dihedral_kernel.HAVE_NUMBA:
+            dihedral_kernel.dihedrals_numba(self.positions[:1], self.quadruplets, BOX)  # compile outside the timing
+
+    def time_numpy(self, n):
+        dihedral_kernel.dihedrals_numpy(self.positions, self.quadruplets, BOX)
+
+    def time_numba(self, n):
+        if not dihedral_kernel.HAVE_NUMBA:
+            raise NotImplementedError('numba is not installed')
+        dihedral_kernel.dihedrals_numba(self.positions, self.quadruplets, BOX)
+
+
+class TimeAtomGroupDihedrals:
+    params = ([10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6],)
+    param_names = ['n_dihedral_frames']
+    timeout = 600
+    repeat = 1
+    number = 1
+
+    def setup(self, n):
+        positions, self.quadruplets = kernel_input(n)
+        self.universe = atomgroup_universe(positions)
+
+    def time_atomgroup(self, n):
+        atomgroup_dihedrals(self.universe, self.quadruplets)
+
+
+if __name__ == '__main__':
+    print(f"{'dihedral-frames':>16} {'AtomGroup':>12} {'NumPy':>12} {'numba':>12}")
+    for n in TimeDihedralKernel.params[0]:
+        positions, quadruplets = kernel_input(n)
+        u = atomgroup_universe(positions)
+        start = perf_counter()
+        reference = atomgroup_dihedrals(u, quadruplets)
+        atomgroup = perf_counter() - start
+
+        start = perf_counter()
+        kernel = dihedral_kernel.dihedrals_numpy(positions, quadruplets, BOX)
+        numpy_path = perf_counter() - start
+        # AtomGroup.dihedral.value() works in float32, the kernel in float64
+        difference = np.abs((kernel - reference + 180) % 360 - 180)
+        assert difference.max() < 1e-2, 'kernel differs from AtomGroup.dihedral.value()'
+
+        numba_path = float('nan')
+        if dihedral_kernel.HAVE_NUMBA:
+            dihedral_kernel.dihedrals_numba(positions[:1], quadruplets, BOX)
+            start = perf_counter()
+            dihedral_kernel.dihedrals_numba(positions, quadruplets, BOX)
+            numba_path = perf_counter() - start
+        print(f'{n:>16} {atomgroup:>11.4f}s {numpy_path:>11.4f}s {numba_path:>11.4f}s')
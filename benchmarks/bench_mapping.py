@@ -0,0 +1,29 @@
+'''IUPAC parsing (GlycanProcessor.process_glycan) and structure mapping (GlycanAnalyzer.structure_mapping)
+on synthetic glycan libraries of increasing size and branching.'''
+from synthetic import glycan_library
+from iupac_to_mapping import string_process
+from iupac_to_mapping import iupac_converter
+
+
+def structure_mapping(library, glysites):
+    '''The notebook pipeline from IUPAC strings to {chain: mapping DataFrame}.'''
+    processor = string_process.GlycanProcessor(library, glysites)
+    glycan_format_dict = processor.process_glycan()
+    analyzer = iupac_converter.GlycanAnalyzer(glycan_format_dict, processor.core_triplet_dict(glycan_format_dict), processor)
+    analyzer.branch_processing()
+    return analyzer.structure_mapping()
+
+
+class TimeMapping:
+    params = ([10, 100, 1000], [2, 4])
+    param_names = ['n_glycans', 'max_antennae']
+
+    def setup(self, n_glycans, max_antennae):
+        self.library = glycan_library(n_glycans, max_antennae)
+        self.glysites = list(range(1, n_glycans + 1))
+
+    def time_process_glycan(self, n_glycans, max_antennae):
+        string_process.GlycanProcessor(self.library, self.glysites).process_glycan()
+
+    def time_structure_mapping(self, n_glycans, max_antennae):
+        structure_mapping(self.library, self.glysites)
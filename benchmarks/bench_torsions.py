@@ -0,0 +1,33 @@
+'''Torsion throughput of GlycanTorsions.glycan_torsions in frames/sec on generated trajectories.'''
+import io
+import contextlib
+from time import perf_counter
+import MDAnalysis as mda
+from synthetic import glycoprotein
+from bench_mapping import structure_mapping
+from iupac_to_mapping import glycan_chain_indices
+from iupac_to_mapping import compute_torsions
+
+N_FRAMES = 100
+
+
+class TrackTorsionThroughput:
+    params = ([5, 50], ['phi', 'psi', 'omega'])
+    param_names = ['n_sites', 'torsion']
+    unit = 'frames/sec'
+
+    def setup(self, n_sites, torsion):
+        topology, trajectory, glysites, library = glycoprotein(n_sites, N_FRAMES)
+        self.universe = mda.Universe(topology, trajectory)
+        glycans = self.universe.select_atoms('not resname ALA and not resname ASN')
+        atom_indices = glycan_chain_indices.GlycanStructure(glycans, ['BGLCN', 'BGLCN', 'BMAN']).find_indices()
+        with contextlib.redirect_stdout(io.StringIO()):
+            mapping = structure_mapping(library, glysites)
+        self.torsions = compute_torsions.GlycanTorsions(library, glysites, self.universe, atom_indices, mapping)
+        self.torsions.dihedral_plan(torsion)      # topology checksum and atom lookups outside the timing
+
+    def track_frames_per_sec(self, n_sites, torsion):
+        start = perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.torsions.glycan_torsions(torsion, self.universe)
+        return N_FRAMES / (perf_counter() - start)
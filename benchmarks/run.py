@@ -0,0 +1,165 @@
+'''Runs the asv-style benchmarks in this directory and compares them to the tracked baseline.
+
+Classes in bench_*.py files with time_* methods (seconds, lower is better) and track_* methods
+(returning a value, higher is better) are run for every combination of their params, with
+setup(*params) called before the timing. Class attributes repeat and number are honoured, and
+a class attribute budget ({param: limit}) fails the run when a result is worse than its limit.
+
+    python benchmarks/run.py                        # run all, compare to baseline.json
+    python benchmarks/run.py -k find_indices        # only benchmarks matching a regex
+    python benchmarks/run.py --save results.json    # keep the results
+    python benchmarks/run.py --update-baseline      # record the results as the new baseline
+
+The exit code is 1 if any benchmark is more than --threshold times worse than its baseline,
+fails an assertion or is over its budget.'''
+import os
+import re
+import sys
+import json
+import glob
+import argparse
+import platform
+import importlib
+import itertools
+from time import perf_counter
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(BENCHMARK_DIR, 'baseline.json')
+sys.path.insert(0, BENCHMARK_DIR)
+
+
+def benchmarks(pattern=None):
+    '''yields (name, class, method name, params) of every benchmark matching the regex pattern.'''
+    for path in sorted(glob.glob(os.path.join(BENCHMARK_DIR, 'bench_*.py'))):
+        module = importlib.import_module(os.path.splitext(os.path.basename(path))[0])
+        for class_name, cls in sorted(vars(module).items()):
+            if not isinstance(cls, type) or cls.__module__ != module.__name__:
+                continue
+            for method in sorted(m for m in vars(cls) if m.startswith(('time_', 'track_'))):
+                for params in itertools.product(*getattr(cls, 'params', ())):
+                    name = f"{module.__name__}.{class_name}.{method}({', '.join(map(str, params))})"
+                    if pattern is None or re.search(pattern, name):
+                        yield name, cls, method, params
+
+
+def run_benchmark(cls, method, params):
+    '''returns the best of repeat runs: the shortest time per call in seconds for time_ methods,
+    the highest returned value for track_ methods, or the lowest if their unit is seconds.'''
+    instance = cls()
+    if hasattr(instance, 'setup'):
+        instance.setup(*params)
+    func = getattr(instance, method)
+    repeat = getattr(cls, 'repeat', 3)
+    try:
+        if method.startswith('track_'):
+            values = [func(*params) for _ in range(repeat)]
+            return min(values) if getattr(cls, 'unit', '') == 'seconds' else max(values)
+
+        number = getattr(cls, 'number', 0)
+        if not number:
+            # calls per sample so that a sample takes at least 0.1 s
+            start = perf_counter()
+            func(*params)
+            number = max(1, int(0.1 / max(perf_counter() - start, 1e-9)))
+        samples = []
+        for _ in range(repeat):
+            start = perf_counter()
+            for _ in range(number):
+                func(*params)
+            samples.append((perf_counter() - start) / number)
+        return min(samples)
+    finally:
+        if hasattr(instance, 'teardown'):
+            instance.teardown(*params)
+
+
+def over_budget(cls, params, value, unit):
+    '''returns the budget of a result if the value is worse than it, otherwise None.'''
+    budget = getattr(cls, 'budget', None)
+    if isinstance(budget, dict):
+        budget = budget.get(params[0] if len(params) == 1 else tuple(params))
+    if budget is None:
+        return None
+    worse = value > budget if unit == 'seconds' else value < budget
+    return budget if worse else None
+
+
+def run(pattern=None):
+    '''returns the results and the names of the benchmarks that failed or went over budget.'''
+    results, failed = {}, []
+    for name, cls, method, params in benchmarks(pattern):
+        try:
+            value = run_benchmark(cls, method, params)
+        except NotImplementedError as e:
+            print(f'{name:<84} skipped: {e}')
+            continue
+        except AssertionError as e:
+            print(f'{name:<84} FAILED: {e}')
+            failed.append(name)
+            continue
+        unit = 'seconds' if method.startswith('time_') else getattr(cls, 'unit', '')
+        results[name] = {'value': value, 'unit': unit}
+        print(f'{name:<84} {value:12.6g} {unit}')
+        budget = over_budget(cls, params, value, unit)
+        if budget is not None:
+            print(f'OVER BUDGET {name}: {value:.6g} {unit}, budget {budget:.6g}')
+            failed.append(name)
+    return results, failed
+
+
+def environment():
+    return {'python': platform.python_version(), 'numpy': np.__version__,
+            'machine': platform.machine(), 'processor': platform.processor(), 'cpus': os.cpu_count()}
+
+
+def regressions(results, baseline, threshold):
+    '''returns the names of the results more than threshold times worse than their baseline value.'''
+    slower = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        value, reference = result['value'], baseline[name]['value']
+        if result['unit'] == 'seconds':
+            ratio = value / reference
+        else:
+            ratio = reference / value if value else float('inf')
+        if ratio > threshold:
+            slower.append(name)
+            print(f'REGRESSION {name}: {reference:.6g} -> {value:.6g} {result["unit"]} ({ratio:.2f}x worse)')
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-k', dest='pattern', help='only run benchmarks whose name matches this regex')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--baseline', default=BASELINE, help='baseline JSON file to compare to')
+    parser.add_argument('--threshold', type=float, default=1.5, help='slowdown factor reported as a regression')
+    parser.add_argument('--update-baseline', action='store_true', help='merge the results into the baseline')
+    args = parser.parse_args(argv)
+
+    results, failed = run(args.pattern)
+    report = {'environment': environment(), 'results': results}
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=1)
+
+    baseline = {'environment': environment(), 'results': {}}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    if args.update_baseline:
+        baseline['environment'] = environment()
+        baseline['results'].update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+        return 1 if failed else 0
+
+    slower = regressions(results, baseline['results'], args.threshold)
+    return 1 if slower or failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+'''Deterministic synthetic data for the benchmarks, so they run offline: N-glycan IUPAC libraries of
+increasing branching and glycoprotein topologies/trajectories with any number of glycosylation sites.'''
+import os
+import sys
+import tempfile
+import numpy as np
+import MDAnalysis as mda
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from iupac_to_mapping import glycan_tree
+from iupac_to_mapping import glycan_chain_indices
+
+CORE = 'Man(b1-4)GlcNAc(b1-4)GlcNAc(b1-'
+CORE_FUCOSE = 'Man(b1-4)GlcNAc(b1-4)[D-Fuc(a1-6)]GlcNAc(b1-'
+
+GLYCAN_ATOMS = ['C1', 'C2', 'C3', 'C4', 'C5', 'C6', 'O2', 'O3', 'O4', 'O5', 'O6']
+ASN_ATOMS = ['N', 'CA', 'CB', 'CG', 'OD1', 'ND2']
+PROTEIN_ATOMS = ['N', 'CA', 'CB', 'C', 'O']
+BOX = [80.0, 80.0, 80.0, 90.0, 90.0, 90.0]
+
+
+def antenna(rng, linkage):
+    '''GlcNAc antenna attached by linkage, extended by a Gal and a Neu5Ac at random.'''
+    residues = f'GlcNAc(b1-{linkage})'
+    if rng.random() < 0.8:
+        residues = f'Gal(b1-{rng.choice([3, 4])})' + residues
+        if rng.random() < 0.6:
+            residues = f'Neu5Ac(a2-{rng.choice([3, 6])})' + residues
+    return residues
+
+
+def arm(rng, linkage, n_antennae):
+    '''Man(a1-linkage) arm carrying one or two antennae.'''
+    if n_antennae == 1:
+        return antenna(rng, 2) + f'Man(a1-{linkage})'
+    second = int(rng.choice([4, 6])) if linkage == 3 else 4
+    return antenna(rng, 2) + '[' + antenna(rng, second) + ']' + f'Man(a1-{linkage})'
+
+
+def n_glycan(rng, n_antennae=2):
+    '''IUPAC string of a complex N-glycan with 2, 3 or 4 antennae.'''
+    antennae_3 = 2 if n_antennae == 4 or (n_antennae == 3 and rng.random() < 0.5) else 1
+    antennae_6 = n_antennae - antennae_3
+    core = CORE_FUCOSE if rng.random() < 0.3 else CORE
+    return arm(rng, 3, antennae_3) + '[' + arm(rng, 6, antennae_6) + ']' + core
+
+
+def glycan_library(n_glycans, max_antennae=4, seed=0):
+    '''{chain id: IUPAC string} of n_glycans N-glycans with 2 up to max_antennae antennae.'''
+    rng = np.random.default_rng(seed)
+    return {f'chain {glycan_chain_indices.chain_id(i + 1)}': n_glycan(rng, int(rng.integers(2, max_antennae + 1)))
+            for i in range(n_glycans)}
+
+
+def glycoprotein(n_sites, n_frames=10, seed=0, out_dir=None):
+    '''Writes a glycoprotein with n_sites glycosylated ASN residues, one N-glycan of glycan_library on
+    each, and an n_frames trajectory of small random displacements.
+    returns the topology (.gro) and trajectory (.xtc) paths, the glycosylation sites and the
+    {chain: IUPAC string} of the glycans, files are reused when they exist.'''
+    library = glycan_library(n_sites, seed=seed)
+    glysites = [10 * i + 5 for i in range(n_sites)]
+    out_dir = out_dir or os.path.join(tempfile.gettempdir(), 'glycan_benchmarks')
+    os.makedirs(out_dir, exist_ok=True)
+    topology = os.path.join(out_dir, f'glycoprotein_{n_sites}_{seed}.gro')
+    trajectory = os.path.join(out_dir, f'glycoprotein_{n_sites}_{seed}_{n_frames}.xtc')
+    if os.path.exists(topology) and os.path.exists(trajectory):
+        return topology, trajectory, glysites, library
+
+    resnames, resids, names = [], [], []
+    for r in range(1, 10 * n_sites + 1):
+        resname = 'ASN' if r in glysites else 'ALA'
+        for name in (ASN_ATOMS if resname == 'ASN' else PROTEIN_ATOMS):
+            resnames.append(resname)
+            resids.append(r)
+            names.append(name)
+    r = 10 * n_sites
+    for (chain, iupac), site in zip(library.items(), glysites):
+        for resname in glycan_tree.parse_iupac(iupac).structure_mapping(site)['glycan2']:
+            r += 1
+            for name in GLYCAN_ATOMS:
+                resnames.append(resname)
+                resids.append(r)
+                names.append(name)
+
+    resids = np.asarray(resids)
+    new_residue = np.r_[False, np.diff(resids) != 0]
+    starts = np.flatnonzero(np.r_[True, new_residue[1:]])
+    u = mda.Universe.empty(len(names), n_residues=len(starts), atom_resindex=np.cumsum(new_residue), trajectory=True)
+    u.add_TopologyAttr('name', names)
+    u.add_TopologyAttr('resname', [resnames[i] for i in starts])
+    u.add_TopologyAttr('resid', resids[starts])
+    u.dimensions = BOX
+
+    rng = np.random.default_rng(seed)
+    positions = rng.uniform(0, BOX[0], (len(names), 3)).astype(np.float32)
+    u.atoms.positions = positions
+    u.atoms.write(topology)
+    with mda.Writer(trajectory, len(names)) as writer:
+        for frame in range(n_frames):
+            u.atoms.positions = positions + rng.normal(0, 0.3, positions.shape).astype(np.float32)
+            u.trajectory.ts.time = 10.0 * frame
+            writer.write(u.atoms)
+    return topology, trajectory, glysites, library
@@ -0,0 +1,43 @@
+'''numba kernels of dihedral_kernel, imported on the first call of its numba path.'''
+import numpy as np
+import numba
+
+
+@numba.njit(cache=True)
+def _bond(a, b, length, periodic):
+    v = b - a
+    if periodic:
+        v -= length * np.floor(v / length + 0.5)
+    return v
+
+
+@numba.njit(cache=True)
+def _dihedral(p0, p1, p2, p3, lengths, periodic):
+    # scalar components, so no temporary arrays are allocated per dihedral
+    b1x, b1y, b1z = (_bond(p0[0], p1[0], lengths[0], periodic), _bond(p0[1], p1[1], lengths[1], periodic),
+                     _bond(p0[2], p1[2], lengths[2], periodic))
+    b2x, b2y, b2z = (_bond(p1[0], p2[0], lengths[0], periodic), _bond(p1[1], p2[1], lengths[1], periodic),
+                     _bond(p1[2], p2[2], lengths[2], periodic))
+    b3x, b3y, b3z = (_bond(p2[0], p3[0], lengths[0], periodic), _bond(p2[1], p3[1], lengths[1], periodic),
+                     _bond(p2[2], p3[2], lengths[2], periodic))
+    n1x, n1y, n1z = b1y * b2z - b1z * b2y, b1z * b2x - b1x * b2z, b1x * b2y - b1y * b2x
+    n2x, n2y, n2z = b2y * b3z - b2z * b3y, b2z * b3x - b2x * b3z, b2x * b3y - b2y * b3x
+    norm = np.sqrt(b2x * b2x + b2y * b2y + b2z * b2z)
+    m1x, m1y, m1z = (b2y * n1z - b2z * n1y) / norm, (b2z * n1x - b2x * n1z) / norm, (b2x * n1y - b2y * n1x) / norm
+    x = n1x * n2x + n1y * n2y + n1z * n2z
+    y = m1x * n2x + m1y * n2y + m1z * n2z
+    return np.degrees(np.arctan2(y, x))
+
+
+# serial: frame blocks already run in worker processes, and numba's thread pool is not fork-safe
+@numba.njit(cache=True)
+def dihedrals(positions, quadruplets, box, periodic):
+    n_frames = positions.shape[0]
+    n_dihedrals = quadruplets.shape[0]
+    angles = np.empty((n_frames, n_dihedrals))
+    for f in range(n_frames):
+        for d in range(n_dihedrals):
+            angles[f, d] = _dihedral(positions[f, quadruplets[d, 0]], positions[f, quadruplets[d, 1]],
+                                     positions[f, quadruplets[d, 2]], positions[f, quadruplets[d, 3]],
+                                     box[f, :3], periodic)
+    return angles
@@ -0,0 +1,88 @@
+import json
+import logging
+from time import time
+import numpy as np
+from iupac_to_mapping import mapping_cache
+from iupac_to_mapping import lazy
+
+pd = lazy.lazy_import('pandas')
+
+# summary of every batch, as JSON at INFO level
+logger = logging.getLogger('iupac_to_mapping.batch_mapping')
+
+
+def batch_structure_mapping(glycans, cache=None, report=False):
+    '''Parses a whole glycan library in one pass and returns one long-format mapping table.
+
+    glycans: iterable of IUPAC strings (ids are their position), or a dict / iterable of
+    (glycan_id, IUPAC) pairs, e.g. a GlyTouCan or GlyConnect export
+    cache: MappingCache shared between batches, every distinct glycan is parsed only once
+    report: also prints the number of glycans and the throughput in glycans/sec, the summary is
+    always logged to the iupac_to_mapping.batch_mapping logger
+
+    returns a DataFrame with columns glycan_id, glycan2, index2, linkage, glycan1, index1, one row
+    per linkage; index1 of the protein-glycan linkage is left empty as there is no glycosylation site.
+    Throughput and the ids of glycans that could not be parsed are in table.attrs['stats'].'''
+
+    cache = mapping_cache.default_cache if cache is None else cache
+    start = time()
+
+    if isinstance(glycans, dict):
+        glycans = glycans.items()
+    glycans = [(i, g) if isinstance(g, str) else tuple(g) for i, g in enumerate(glycans)]
+
+    # distinct glycans are parsed once, every glycan then refers to the position of its mapping
+    unique_rows = {}
+    unique_mappings = []
+    glycan_ids = []
+    positions = []
+    failed = []
+    for glycan_id, iupac in glycans:
+        key = mapping_cache.normalize_iupac(iupac)
+        if key not in unique_rows:
+            mapping = cache.get(iupac)
+            if mapping is None:
+                try:
+                    mapping = mapping_cache.parse_structure_mapping(iupac)
+                except Exception:
+                    mapping = None
+                else:
+                    cache.put(iupac, mapping)
+            if mapping is not None:
+                unique_mappings.append(mapping)
+            unique_rows[key] = len(unique_mappings) - 1 if mapping is not None else None
+
+        if unique_rows[key] is None:
+            failed.append(glycan_id)
+            continue
+        glycan_ids.append(glycan_id)
+        positions.append(unique_rows[key])
+
+    columns = ['glycan2', 'index2', 'linkage', 'glycan1', 'index1']
+    if unique_mappings:
+        unique_table = pd.concat(unique_mappings, ignore_index=True)[columns]
+        lengths = np.array([len(m) for m in unique_mappings])
+        offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+
+        # rows of every glycan in the concatenated unique table, gathered in one take
+        n_rows = lengths[positions]
+        first_row = np.repeat(offsets[positions] - np.concatenate([[0], np.cumsum(n_rows)[:-1]]), n_rows)
+        table = unique_table.iloc[first_row + np.arange(n_rows.sum())].reset_index(drop=True)
+        table.loc[np.concatenate([[0], np.cumsum(n_rows)[:-1]]), 'index1'] = None
+        table.insert(0, 'glycan_id', np.repeat(np.array(glycan_ids, dtype=object), n_rows))
+    else:
+        table = pd.DataFrame(columns=['glycan_id'] + columns)
+
+    elapsed = time() - start
+    stats = {'n_glycans': len(glycans),
+             'n_unique': len(unique_rows),
+             'n_failed': len(failed),
+             'failed': failed,
+             'seconds': elapsed,
+             'glycans_per_sec': len(glycans) / elapsed if elapsed > 0 else float('inf')}
+    table.attrs['stats'] = stats
+    logger.info(json.dumps(stats))
+    if report:
+        print(f"Parsed {stats['n_glycans']} glycans ({stats['n_unique']} unique, {stats['n_failed']} failed) "
+              f"in {elapsed:.2f} secs: {stats['glycans_per_sec']:.0f} glycans/sec")
+    return table
@@ -0,0 +1,216 @@
+'''glycan-torsions: computes the glycosidic torsions of a glycoprotein trajectory into a TorsionStore,
+without a notebook in the loop, e.g. one job of a SLURM array per trajectory:
+
+    glycan-torsions topol.gro md.xtc --glycans glycans.csv --output torsions/md --workers 8
+
+glycans.csv has one row per glycosylation site with the columns chain, site and iupac;
+YAML (needs PyYAML) and JSON spec files hold {chain: {site: ..., iupac: ...}} or a list of such rows.
+
+Exit codes: 0 when the store is complete (also when it already was, the job is then skipped),
+1 when the run failed, 2 for invalid arguments or input files, or an existing store written with
+other torsions or frames (--overwrite recomputes it), 130 when interrupted.
+Every chunk of frames (or replica) is checkpointed in the store, so the next run of an interrupted
+or failed job continues after the last completed chunk.'''
+import os
+import sys
+import csv
+import json
+import shutil
+import logging
+import argparse
+import traceback
+from iupac_to_mapping import lazy
+from iupac_to_mapping import profiling
+
+mda = lazy.lazy_import('MDAnalysis')
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_INTERRUPTED = 130
+
+# the notebook's glycan selection and core of the GROMACS/CHARMM glycan residue names
+GLYCAN_SELECTION = 'not protein and not resname SOD and not resname CLA and not resname TIP3'
+CORE = ('BGLCN', 'BGLCN', 'BMAN')
+
+
+def read_glycan_spec(path):
+    '''Reads the site -> IUPAC spec file of a glycoprotein (.csv, .yaml/.yml or .json).
+    returns the iupac_string {chain: IUPAC} and glysites [ASN resid per chain] used by GlycanTorsions.'''
+    extension = os.path.splitext(path)[1].lower()
+    with open(path) as f:
+        if extension == '.csv':
+            rows = list(csv.DictReader(f))
+        elif extension in ('.yaml', '.yml'):
+            if not lazy.is_available('yaml'):
+                raise ImportError('YAML glycan spec files need the PyYAML package')
+            import yaml
+            rows = yaml.safe_load(f)
+        elif extension == '.json':
+            rows = json.load(f)
+        else:
+            raise ValueError(f'glycan spec file must be .csv, .yaml, .yml or .json, not {path}')
+
+    if isinstance(rows, dict):
+        rows = [dict(spec, chain=chain) for chain, spec in rows.items()]
+    if not rows:
+        raise ValueError(f'no glycans in {path}')
+
+    iupac_string, glysites = {}, []
+    for i, row in enumerate(rows, 1):
+        missing = {'chain', 'site', 'iupac'} - set(row or ())
+        if missing:
+            raise ValueError(f"glycan {i} of {path} has no {', '.join(sorted(missing))}")
+        chain = str(row['chain']).strip()
+        if chain in iupac_string:
+            raise ValueError(f'chain {chain} appears twice in {path}')
+        try:
+            glysites.append(int(row['site']))
+        except (TypeError, ValueError):
+            raise ValueError(f"site of chain {chain} in {path} is not a residue number: {row['site']!r}") from None
+        iupac_string[chain] = str(row['iupac']).strip()
+    return iupac_string, glysites
+
+
+def spec_structure_mapping(iupac_string, glysites):
+    '''returns the {chain: structure mapping} of the glycans of a spec file, raises ValueError
+    naming the chain if an IUPAC string cannot be parsed.'''
+    from iupac_to_mapping import mapping_cache
+
+    structure_mapping = {}
+    for (chain, iupac), site in zip(iupac_string.items(), glysites):
+        try:
+            structure_mapping[chain] = mapping_cache.default_cache.structure_mapping(iupac, site)
+        except ValueError as e:
+            raise ValueError(f'invalid IUPAC string of {chain}: {e}') from None
+    return structure_mapping
+
+
+def glycan_torsions(topology, trajectories, iupac_string, glysites, structure_mapping, selection=GLYCAN_SELECTION,
+                    core=CORE):
+    '''Runs the notebook pipeline from the structure mappings to the torsions: atom indices of the
+    glycans in the topology and the GlycanTorsions of the Universe of topology and trajectories
+    (several trajectories are read one after another as one trajectory).
+    returns the GlycanTorsions and the Universe.'''
+    from iupac_to_mapping import compute_torsions
+    from iupac_to_mapping import glycan_chain_indices
+
+    universe = mda.Universe(topology, *trajectories)
+    glycan_atoms = universe.select_atoms(selection)
+    atom_indices = glycan_chain_indices.GlycanStructure(glycan_atoms, list(core)).find_indices()
+    torsions = compute_torsions.GlycanTorsions(iupac_string, glysites, universe, atom_indices, structure_mapping)
+    return torsions, universe
+
+
+def open_store(path, overwrite=False):
+    '''returns the TorsionStore at path, or None if there is none or overwrite is True,
+    in which case an existing store is removed.'''
+    from iupac_to_mapping import torsion_store
+
+    if not os.path.exists(os.path.join(path, torsion_store.TorsionStore.metadata_file)):
+        return None
+    if overwrite:
+        shutil.rmtree(path)
+        return None
+    return torsion_store.TorsionStore(path)
+
+
+def run(args):
+    '''Runs the job described by the parsed command-line arguments. returns the exit code.'''
+    from iupac_to_mapping import compute_torsions
+    from iupac_to_mapping import ensemble
+    from iupac_to_mapping import torsion_store
+
+    # everything is validated and the plan built before --overwrite removes an existing store
+    try:
+        iupac_string, glysites = read_glycan_spec(args.glycans)
+        structure_mapping = spec_structure_mapping(iupac_string, glysites)
+        # replicas are opened by the workers, only the topology is needed for the dihedral plan
+        trajectories = [] if args.replicas else args.trajectories
+        torsions, universe = glycan_torsions(args.topology, trajectories, iupac_string, glysites, structure_mapping,
+                                             args.selection, args.core)
+        plan = torsions.dihedral_plan(args.torsions)
+        if args.replicas:
+            # applied to the frames of every replica
+            frames = slice(args.start, args.stop, args.step)
+        else:
+            frames = compute_torsions.select_frames(universe.trajectory, args.start, args.stop, args.step)
+    except (OSError, ValueError, ImportError) as e:
+        print(f'glycan-torsions: {e}', file=sys.stderr)
+        return EXIT_USAGE
+
+    store = open_store(args.output, args.overwrite)
+    if store is not None:
+        try:
+            store.check_plan(plan.columns(), plan_hash=plan.checksum())
+            store.check_frames(torsion_store.frame_selection(frames))
+        except ValueError as e:
+            print(f'glycan-torsions: {e}, use --overwrite to recompute it', file=sys.stderr)
+            return EXIT_USAGE
+        if store.complete:
+            print(f'{args.output} is complete ({len(store)} rows), skipping')
+            return EXIT_OK
+        print(f'resuming {args.output} after {len(store)} rows')
+
+    if args.replicas:
+        runner = ensemble.EnsembleRunner(args.topology, args.trajectories, plan, args.workers, frames=frames,
+                                         progress=args.progress or None)
+        structure_mapping = {k: torsions.glycan_graph(k).structure_mapping(g) for k, g in zip(iupac_string, glysites)}
+        store = runner.write_store(args.output, structure_mapping, resume=True, chunk_size=args.chunk_size)
+        if runner.failed:
+            for r, error in sorted(runner.failed.items()):
+                print(f'replica {r} ({args.trajectories[r]}) failed: {error}', file=sys.stderr)
+            return EXIT_FAILED
+    else:
+        store = torsions.write_store(args.output, universe, args.torsions, args.chunk_size, frames=frames,
+                                     progress=args.progress or None, n_workers=args.workers, resume=True)
+
+    store.mark_complete()
+    print(f'wrote {len(store)} rows of {len(store.columns)} torsions to {args.output}')
+    return EXIT_OK
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='glycan-torsions', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('topology', help='topology file, e.g. .gro, .pdb or .tpr')
+    parser.add_argument('trajectories', nargs='+', help='trajectory files, read as one trajectory unless --replicas')
+    parser.add_argument('--glycans', required=True, help='glycan spec file (.csv, .yaml or .json) of site -> IUPAC')
+    parser.add_argument('-o', '--output', required=True, help='directory of the torsion store to write')
+    parser.add_argument('--torsions', nargs='+', choices=('phi', 'psi', 'omega'), default=['phi', 'psi', 'omega'],
+                        help='torsion types (default: phi psi omega)')
+    parser.add_argument('--start', type=int, help='first frame')
+    parser.add_argument('--stop', type=int, help='frame to stop before')
+    parser.add_argument('--step', type=int, help='read every step-th frame')
+    parser.add_argument('-j', '--workers', type=int, default=1, help='number of worker processes (default: 1)')
+    parser.add_argument('--replicas', action='store_true',
+                        help='the trajectories are replicas of the topology, stored with a replica number per row')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='frames computed and written at a time')
+    parser.add_argument('--selection', default=GLYCAN_SELECTION, help='MDAnalysis selection of the glycan atoms')
+    parser.add_argument('--core', nargs='+', default=list(CORE), help='residue names of the glycan core')
+    parser.add_argument('--overwrite', action='store_true', help='recompute even if the store is complete')
+    parser.add_argument('--progress', action='store_true', help='print a progress bar on stderr')
+    parser.add_argument('--report', help='write the per-stage timings and counters of the run to this JSON file')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log progress events as JSON on stderr')
+    args = parser.parse_args(argv)
+    if args.workers < 1 or args.chunk_size < 1:
+        parser.error('--workers and --chunk-size must be at least 1')
+    for path in [args.topology, args.glycans] + args.trajectories:
+        if not os.path.exists(path):
+            parser.error(f'{path} does not exist')
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    try:
+        with profiling.run(args.report):
+            return run(args)
+    except KeyboardInterrupt:
+        print(f'glycan-torsions: interrupted, run again to continue {args.output}', file=sys.stderr)
+        return EXIT_INTERRUPTED
+    except Exception:
+        traceback.print_exc()
+        return EXIT_FAILED
+
+
+if __name__ == '__main__':
+    sys.exit(main())
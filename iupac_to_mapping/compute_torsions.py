@@ -1,20 +1,28 @@
-import MDAnalysis as mda
-import pandas as pd
 import numpy as np
 import os
 import itertools 
 from iupac_to_mapping import string_process
 from iupac_to_mapping import iupac_converter
 from iupac_to_mapping import glycan_chain_indices
-from time import time
+from iupac_to_mapping import glycan_tree
+from iupac_to_mapping import torsion_store
+from iupac_to_mapping import dihedral_plan
+from iupac_to_mapping import coordinate_cache
+from iupac_to_mapping import dihedral_kernel
+from iupac_to_mapping import profiling
+from iupac_to_mapping import progress as progress_report
+from time import time, perf_counter
 from functools import wraps
-from MDAnalysis.analysis.dihedrals import Dihedral
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from iupac_to_mapping import lazy
 
-from MDAnalysis.analysis.base import (AnalysisBase,
-                                      AnalysisFromFunction,
-                                     analysis_class)
+pd = lazy.lazy_import('pandas')
+mda = lazy.lazy_import('MDAnalysis')
 
 def measure(func):
+    '''Prints the wall time of every call of func if measure.verbose is True. Used on the top-level
+    entry points only, the time spent per stage is in profiling.profiler.'''
     @wraps(func)
     def _time_it(*args, **kwargs):
         start = time()
@@ -22,13 +30,247 @@ def measure(func):
             return func(*args, **kwargs)
         finally:
             end_ = time() - start
-            mins, secs = divmod(end_, 60)
-#             print(f"Total execution time: {mins:.0f} mins {secs:.2f} secs")
+            if measure.verbose:
+                mins, secs = divmod(end_, 60)
+                print(f"{func.__qualname__}: Total execution time: {mins:.0f} mins {secs:.2f} secs")
     return _time_it
 
 
-@measure
+measure.verbose = False
+
+
+def dihedral_angles(positions, quadruplets, box=None):
+    '''Dihedrals of a single frame, see dihedral_kernel.dihedrals.
+    positions: (n_atoms x 3) coordinates, quadruplets: (n_dihedrals x 4) indices into positions,
+    box: unit cell dimensions [lx, ly, lz, alpha, beta, gamma], bond vectors are minimum imaged if given.
+    returns the dihedral angles in degrees in [-180, 180], same convention as AtomGroup.dihedral.value().'''
+    return dihedral_kernel.dihedrals(positions, quadruplets, box)[0]
+
+
+def frame_block_angles(frames, used_atoms, local, dtype=np.float32, times=None, progress=None):
+    '''Computes the dihedrals of every frame of a (sliced) trajectory reader.
+    used_atoms: atom indices gathered per frame, local: (n_dihedrals x 4) indices into used_atoms,
+    times: optional array that is filled with the time of each frame,
+    progress: optional progress.Progress updated after every frame.'''
+    angles = np.empty((len(frames), len(local)), dtype=dtype)
+    # reading a frame happens in the iterator, so the time between kernel calls is trajectory I/O
+    io_seconds = kernel_seconds = 0.0
+    read_start = perf_counter()
+    for f, ts in enumerate(frames):
+        kernel_start = perf_counter()
+        angles[f] = dihedral_angles(ts.positions[used_atoms], local, ts.dimensions)
+        if times is not None:
+            times[f] = ts.time
+        io_seconds += kernel_start - read_start
+        read_start = perf_counter()
+        kernel_seconds += read_start - kernel_start
+        if progress is not None:
+            progress.update()
+
+    profiling.profiler.add_time('trajectory_io', io_seconds)
+    profiling.profiler.add_time('kernel', kernel_seconds)
+    profiling.count('frames', len(angles))
+    profiling.count('dihedral_frames', angles.size)
+    return angles
+
+
+def coordinate_block_angles(coordinates, used_atoms, local, dtype=np.float32, frames=None, times=None, progress=None):
+    '''Computes the dihedrals of the given frame numbers (all if None) from preloaded GlycanCoordinates.
+    used_atoms: topology atom indices gathered per frame, local: (n_dihedrals x 4) indices into used_atoms,
+    times: optional array that is filled with the time of each frame,
+    progress: optional progress.Progress updated after every block of frames.'''
+    columns = coordinates.columns(used_atoms)
+    rows = coordinates.rows(frames)
+    angles = np.empty((len(rows), len(local)), dtype=dtype)
+    # the kernel takes all frames of a block at once, blocks bound the float64 temporaries
+    block = max(1, 2 ** 20 // max(1, len(local)))
+    for start in range(0, len(rows), block):
+        block_rows = rows[start:start + block]
+        with profiling.stage('trajectory_io'):
+            box = None if coordinates.dimensions is None else coordinates.dimensions[block_rows]
+            positions = coordinates.positions[block_rows][:, columns]
+        with profiling.stage('kernel'):
+            angles[start:start + block] = dihedral_kernel.dihedrals(positions, local, box)
+        if progress is not None:
+            progress.update(len(block_rows))
+    if times is not None:
+        times[:] = coordinates.times[rows]
+    profiling.count('frames', len(angles))
+    profiling.count('dihedral_frames', angles.size)
+    return angles
+
+
+def preload_coordinates(traj, atoms, frames=None, path=None, metadata=None):
+    '''Reads the positions of only the given atoms of the given frames (all if None) of traj into
+    GlycanCoordinates, held in RAM or, if path is given, written frame by frame to a memory-mapped
+    directory at path that GlycanCoordinates.load can reopen later, with metadata in its metadata.json.'''
+    if frames is None:
+        frames = np.arange(len(traj.trajectory))
+    coordinates = coordinate_cache.GlycanCoordinates.empty(atoms, frames, path)
+    with profiling.stage('trajectory_io'):
+        for row, ts in enumerate(frame_iterator(traj.trajectory, frames)):
+            coordinates.set_frame(row, ts)
+    profiling.count('frames_preloaded', len(frames))
+    if path is not None:
+        coordinates.save(path, topology=str(traj.filename), **(metadata or {}))
+    return coordinates
+
+
+def select_frames(trajectory, start=None, stop=None, step=None, time_range=None, n_samples=None,
+                  sampling='uniform', seed=None):
+    '''returns the sorted indices of the frames to analyse, without reading any of them except the
+    first and last one for their time when time_range is given. The reader is left on its current frame.
+
+    start, stop, step: slice of the frames
+    time_range: (t_min, t_max) in ps, either may be None, times are taken as t0 + frame * dt if the
+    time of the last frame agrees with that (constant dt), otherwise the time of every frame is read,
+    e.g. for trajectories with variable or restarted time steps
+    n_samples: keep at most n_samples of the selected frames, evenly spaced if sampling is
+    'uniform' or drawn without replacement if it is 'random' (seed for reproducibility)'''
+    frames = np.arange(len(trajectory))[start:stop:step]
+
+    if time_range is not None and len(frames):
+        t_min, t_max = time_range
+        current = trajectory.ts.frame
+        try:
+            n_frames = len(trajectory)
+            times = trajectory[0].time + np.arange(n_frames) * trajectory.dt
+            if n_frames > 1 and not np.isclose(trajectory[n_frames - 1].time, times[-1]):
+                times = np.array([ts.time for ts in trajectory])
+        finally:
+            trajectory[current]
+        times = times[frames]
+        keep = np.ones(len(frames), dtype=bool)
+        if t_min is not None:
+            keep &= times >= t_min
+        if t_max is not None:
+            keep &= times <= t_max
+        frames = frames[keep]
+
+    if n_samples is not None and n_samples < len(frames):
+        if sampling == 'uniform':
+            frames = frames[np.unique(np.linspace(0, len(frames) - 1, n_samples).round().astype(int))]
+        elif sampling == 'random':
+            frames = np.sort(np.random.default_rng(seed).choice(frames, n_samples, replace=False))
+        else:
+            raise ValueError(f"sampling must be 'uniform' or 'random', not {sampling!r}")
+    return frames
+
+
+def frame_iterator(trajectory, frames=None):
+    '''returns an iterator over the given frame indices of trajectory that seeks to each of them,
+    evenly spaced frames are read as a slice, so skipped frames are never decoded.'''
+    if frames is None:
+        return trajectory[:]
+    frames = np.asarray(frames, dtype=np.intp)
+    if len(frames) == 0:
+        return trajectory[0:0]
+    if len(frames) == 1:
+        return trajectory[frames[0]:frames[0] + 1]
+    step = frames[1] - frames[0]
+    if step > 0 and np.all(np.diff(frames) == step):
+        return trajectory[frames[0]:frames[-1] + 1:step]
+    return trajectory[frames]
+
+
+def frame_blocks(frames, n_blocks):
+    '''Splits the frame indices into at most n_blocks contiguous blocks.'''
+    if len(frames) == 0:
+        return []
+    return np.array_split(frames, min(n_blocks, len(frames)))
+
+
+def _torsion_block(topology, trajectory, frames, used_atoms, local, dtype):
+    '''Worker: opens its own Universe and computes the dihedrals of the given frames.
+    returns the angles, the times of the frames and the profiling report of the block.'''
+    profiling.profiler.reset()
+    with profiling.stage('trajectory_io'):
+        u = mda.Universe(topology, trajectory)
+    times = np.empty(len(frames))
+    angles = frame_block_angles(frame_iterator(u.trajectory, frames), used_atoms, local, dtype, times)
+    return angles, times, profiling.profiler.report()
+
+
+def _trajectory_files(traj):
+    '''returns the topology and trajectory file(s) of the Universe traj, to be opened again by workers.'''
+    return traj.filename, getattr(traj.trajectory, 'filenames', traj.trajectory.filename)
+
+
+def parallel_torsion_angles(traj, used_atoms, local, n_workers, dtype=np.float32, frames=None, progress=None,
+                            blocks_per_worker=4, times=None):
+    '''Computes the dihedrals of traj in n_workers processes, blocks_per_worker contiguous frame blocks
+    each (of at least 100 frames), and concatenates the blocks in frame order. Results are identical
+    to frame_block_angles. progress: optional progress.Progress updated as blocks finish.
+    times: optional array filled with the time of every frame.'''
+    topology, trajectory = _trajectory_files(traj)
+    if frames is None:
+        frames = np.arange(len(traj.trajectory))
+    blocks = frame_blocks(frames, max(n_workers, min(n_workers * blocks_per_worker, len(frames) // 100)))
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = {executor.submit(_torsion_block, topology, trajectory, block, used_atoms, local, dtype): i
+                   for i, block in enumerate(blocks)}
+        angles = [None] * len(blocks)
+        block_times = [None] * len(blocks)
+        for future in as_completed(futures):
+            block_angles, block_times[futures[future]], report = future.result()
+            angles[futures[future]] = block_angles
+            profiling.profiler.merge(report)
+            if progress is not None:
+                progress.update(len(block_angles))
+
+    if not angles:
+        return np.empty((0, len(local)), dtype=dtype)
+    if times is not None:
+        times[:] = np.concatenate(block_times)
+    return np.concatenate(angles)
+
+
+def parallel_chunks(traj, used_atoms, local, chunks, n_workers, dtype=np.float32, progress=None):
+    '''Computes the dihedrals of consecutive frame chunks of traj in one pool of n_workers processes,
+    with at most two chunks per worker in flight.
+    yields (frames, times, angles) of every chunk in order, as soon as it and all chunks before it are done.'''
+    topology, trajectory = _trajectory_files(traj)
+
+    def finished(pending):
+        frames, future = pending.popleft()
+        angles, times, report = future.result()
+        profiling.profiler.merge(report)
+        if progress is not None:
+            progress.update(len(angles))
+        return frames, times, angles
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append((chunk, executor.submit(_torsion_block, topology, trajectory, chunk, used_atoms, local,
+                                                   dtype)))
+            if len(pending) >= 2 * n_workers:
+                yield finished(pending)
+        while pending:
+            yield finished(pending)
+
+
+def plan_torsion_array(plan, traj, dtype=np.float32, n_workers=1, frames=None, progress=None):
+    '''Computes the dihedrals of a (loaded) DihedralPlan over traj, without parsing or atom lookups.
+    The topology of traj is checked against the plan first. progress: see progress.make_progress.
+    returns an (n_frames x n_dihedrals) array and the (chain, fname, torsion) column index.'''
+    plan.check_topology(traj)
+    n_frames = len(traj.trajectory) if frames is None else len(frames)
+    progress = progress_report.make_progress(progress, n_frames)
+    if n_workers > 1:
+        angles = parallel_torsion_angles(traj, plan.used_atoms, plan.local, n_workers, dtype, frames, progress)
+    else:
+        angles = frame_block_angles(frame_iterator(traj.trajectory, frames), plan.used_atoms, plan.local, dtype,
+                                    progress=progress)
+    progress.close()
+    return angles, plan.columns()
+
+
 class GlycanTorsions:
+    # which residue of the linkage (2: glycan2, 1: glycan1 or ASN) each of the four torsion atoms belongs to
+    torsion_atom_owner = {'phi': (2, 2, 1, 1), 'psi': (2, 1, 1, 1), 'omega': (1, 1, 1, 1)}
+
     def __init__(self, iupac_string, glysites, gro_file, atom_indices, structure_mapping):
         self.iupac_string = iupac_string
         self.glysites = glysites
@@ -39,6 +281,10 @@ class GlycanTorsions:
         self.result = None
         self.structure_mapping = structure_mapping
         self.traj = None
+        self.atom_index = None
+        self.glycan_graphs = {}
+        self.topology_checksum = None
+        self.coordinate_cache = None
 
 
     def calculate_torsions(self, linkage, option):
@@ -91,194 +337,288 @@ class GlycanTorsions:
                 return glycan_torsions[linkage][2]
 
             
-    def glycan_torsions(self, torsion, traj=None):
-        glycan_atom_dict = {}
-        for x in self.atom_indices[3]:
-            for y in x:
-                glycan_atom_dict.update({y[0]: y[1]})
-                
-                
-        torsion_all = {}
-        
+    def glycan_atom_index(self):
+        '''returns the GlycanAtomIndex of gro_file, built on first use.'''
+        if self.atom_index is None:
+            self.atom_index = glycan_chain_indices.GlycanAtomIndex(self.gro_file, self.atom_indices, self.glysites,
+                                                                   list(self.iupac_string))
+        return self.atom_index
+
+    def glycan_graph(self, chain):
+        '''returns the GlycanGraph of chain, converted once from its structure mapping
+        (a DataFrame, GlycanTree or GlycanGraph).'''
+        if chain not in self.glycan_graphs:
+            self.glycan_graphs[chain] = glycan_tree.as_graph(self.structure_mapping[chain])
+        return self.glycan_graphs[chain]
+
+    @profiling.timed('plan_build')
+    def dihedral_plan(self, torsions=('phi', 'psi', 'omega')):
+        '''Builds the DihedralPlan of the given torsion types for all linkages of all chains.
+
+        The atoms that the torsion types of a linkage have in common are looked up only once.
+        The first two atoms of phi belong to glycan2, for psi only the first one, and omega
+        lies entirely within glycan1 (the residue carrying the O6/C6 of the linkage).
+        The protein-glycan linkage (reducing end) uses the side-chain atoms of the ASN residue.
+        Raises ValueError naming the dihedral if one of its atoms is not in the topology.'''
+
+        torsions = [torsions] if isinstance(torsions, str) else list(torsions)
+        atom_index = self.glycan_atom_index()
+
+        records = ([], [], [], [], [])        # chain, linkage, torsion, linkage type, atoms
         for (k, v), (num, g) in zip(self.structure_mapping.items(), enumerate(self.glysites)):
             resid_resname = [f'{x[0]}' for x in self.atom_indices[3][num]]
-            resid2 = pd.Series({j: i for i, j in zip(resid_resname, v.index)})
-            atoms2 = pd.Series({j: glycan_atom_dict[i] for i, j in zip(resid_resname, v.index)})
-
-            resid1 = {0: 'ASN_'+str(g)}
-            atoms1 = {0: [f'resid {g}']}
-            for a, b in enumerate(v.index[:-1], 1):
-                resid1.update({a: resid_resname[b]})
-                atoms1.update({a: glycan_atom_dict[resid_resname[b]]})
-
-            resid1 = pd.Series(resid1)
-            atoms1 = pd.Series(atoms1)
-            structure_mapping_update = pd.concat([v, resid2, resid1, atoms2, atoms1], axis=1)
-            structure_mapping_update = structure_mapping_update.rename(columns={0: 'resid2', 1: 'resid1', 2: 'atoms2', 3: 'atoms1'})
-            structure_mapping_update = structure_mapping_update[['resid2', 'atoms2', 'glycan2', 'index2', 'linkage', 'resid1', 'atoms1', 'glycan1', 'index1']]
-            
-            # per torsion angle dictionary 
-            
-            torsion_angle = {}
-            for i in structure_mapping_update.index:
-                linkage = structure_mapping_update.iloc[i]['linkage']
-                if torsion == 'phi':
-                        
-                    if i == 0: # i = 0 is always for the N-glycosidic linkage
-                        torsion_phi = self.calculate_torsions(linkage, torsion)
-
-                        sel2 = structure_mapping_update.iloc[i]['atoms2']
-                        sel1 = structure_mapping_update.iloc[i]['atoms1'][0]
-
-                        atom4 = self.gro_file.select_atoms(f'bynum {sel2[0]}:{sel2[1]} and name {torsion_phi[0]}')
-                        atom3 = self.gro_file.select_atoms(f'bynum {sel2[0]}:{sel2[1]} and name {torsion_phi[1]}')
-                        atom2 = self.gro_file.select_atoms(f'{sel1} and name {torsion_phi[2]}')
-                        atom1 = self.gro_file.select_atoms(f'{sel1} and name {torsion_phi[3]}')
-
-
-                        torsion_group = sum([atom4, atom3, atom2, atom1])
-#                         print(torsion_group)
-                        tor_angle = torsion_group.dihedral
-
-                        fname = format(structure_mapping_update.iloc[i]['resid2']) + f'({linkage})' + format(structure_mapping_update.iloc[i]['resid1'])
-                        if not traj == None:
-
-                            torsion_value = [tor_angle.value() for ts in self.traj.trajectory]
-                            torsion_angle.update({fname: torsion_value})
-                        else:
-                            torsion_angle.update({fname: tor_angle.value()})
-
-                    else:
-                        torsion_phi = self.calculate_torsions(linkage, torsion)
-
-                        sel2 = structure_mapping_update.iloc[i]['atoms2']
-                        sel1 = structure_mapping_update.iloc[i]['atoms1']
-
-                        atom4 = self.gro_file.select_atoms(f'bynum {sel2[0]}:{sel2[1]} and name {torsion_phi[0]}')
-                        atom3 = self.gro_file.select_atoms(f'bynum {sel2[0]}:{sel2[1]} and name {torsion_phi[1]}')
-                        atom2 = self.gro_file.select_atoms(f'bynum {sel1[0]}:{sel1[1]} and name {torsion_phi[2]}')
-                        atom1 = self.gro_file.select_atoms(f'bynum {sel1[0]}:{sel1[1]} and name {torsion_phi[3]}')
-
-                        torsion_group = sum([atom4, atom3, atom2, atom1])
-#                         print(torsion_group)
-                        tor_angle = torsion_group.dihedral
-
-                        fname = format(structure_mapping_update.iloc[i]['resid2']) + f'({linkage})' + format(structure_mapping_update.iloc[i]['resid1'])
-                        if not traj == None:
-                            torsion_value = [tor_angle.value() for ts in self.traj.trajectory]
-                            torsion_angle.update({fname: torsion_value})
-                        else:
-                            torsion_angle.update({fname: tor_angle.value()})
-#                     torsion_all.update({k: torsion_angle})
-
-                elif torsion == 'psi':
-
-                    if i == 0:
-                        torsion_psi = self.calculate_torsions(linkage, torsion)
-
-                        sel2 = structure_mapping_update.iloc[i]['atoms2']
-                        sel1 = structure_mapping_update.iloc[i]['atoms1'][0]
-
-                        atom4 = self.gro_file.select_atoms(f'bynum {sel2[0]}:{sel2[1]} and name {torsion_psi[0]}')
-                        atom3 = self.gro_file.select_atoms(f'{sel1} and name {torsion_psi[1]}')
-                        atom2 = self.gro_file.select_atoms(f'{sel1} and name {torsion_psi[2]}')
-                        atom1 = self.gro_file.select_atoms(f'{sel1} and name {torsion_psi[3]}')
-
-
-                        torsion_group = sum([atom4, atom3, atom2, atom1])
-#                         print(torsion_group)
-                        tor_angle = torsion_group.dihedral
-
-                        fname = format(structure_mapping_update.iloc[i]['resid2']) + f'({linkage})' + format(structure_mapping_update.iloc[i]['resid1'])
-                        if not traj == None:
-
-                            torsion_value = [tor_angle.value() for ts in self.traj.trajectory]
-                            torsion_angle.update({fname: torsion_value})
-                        else:
-                            torsion_angle.update({fname: tor_angle.value()})
-
-                    else:
-                        torsion_psi = self.calculate_torsions(linkage, torsion)
-
-                        sel2 = structure_mapping_update.iloc[i]['atoms2']
-                        sel1 = structure_mapping_update.iloc[i]['atoms1']
-
-                        atom4 = self.gro_file.select_atoms(f'bynum {sel2[0]}:{sel2[1]} and name {torsion_psi[0]}')
-                        atom3 = self.gro_file.select_atoms(f'bynum {sel1[0]}:{sel1[1]} and name {torsion_psi[1]}')
-                        atom2 = self.gro_file.select_atoms(f'bynum {sel1[0]}:{sel1[1]} and name {torsion_psi[2]}')
-                        atom1 = self.gro_file.select_atoms(f'bynum {sel1[0]}:{sel1[1]} and name {torsion_psi[3]}')
-
-                        torsion_group = sum([atom4, atom3, atom2, atom1])
-#                             print(torsion_group)
-                        tor_angle = torsion_group.dihedral
-
-                        fname = format(structure_mapping_update.iloc[i]['resid2']) + f'({linkage})' + format(structure_mapping_update.iloc[i]['resid1'])
-                        if not traj == None:
-                            torsion_value = [tor_angle.value() for ts in self.traj.trajectory]
-                            torsion_angle.update({fname: torsion_value})
-                        else:
-                            torsion_angle.update({fname: tor_angle.value()})
-                            
-#                     torsions_all.update({k: torsion_angle})
+            graph = self.glycan_graph(k)
+
+            for i, (linkage, parent) in enumerate(zip(graph.linkages(), graph.parent.tolist())):
+                if i >= len(resid_resname):
+                    break
+
+                resid2 = resid_resname[i]
+                if parent < 0:         # the reducing end, N-glycosidic linkage
+                    resid1 = 'ASN_' + str(g)
+                    residues = {2: resid2, 1: atom_index.asn_label(num)}
+                else:
+                    resid1 = resid_resname[parent]
+                    residues = {2: resid2, 1: resid1}
+                fname = f'{resid2}({linkage}){resid1}'
+
+                linkage_atoms = {}
+                for t in torsions:
+                    atom_names = self.calculate_torsions(linkage, t)
+                    if atom_names is None:
+                        continue
+
+                    quad = []
+                    for owner, name in zip(self.torsion_atom_owner[t], atom_names):
+                        key = (residues[owner], name)
+                        if key not in linkage_atoms:
+                            linkage_atoms[key] = atom_index.index(*key)
+                        if linkage_atoms[key] is None:
+                            raise ValueError(f'{t} of {fname} ({linkage}) in {k}: atom {name} of residue '
+                                             f'{residues[owner]} is not in the topology')
+                        quad.append(linkage_atoms[key])
+
+                    for record, value in zip(records, (k, fname, t, linkage, quad)):
+                        record.append(value)
+
+        if self.topology_checksum is None:
+            self.topology_checksum = dihedral_plan.topology_checksum(self.gro_file)
+        plan = dihedral_plan.DihedralPlan.from_records(*records, self.topology_checksum)
+        profiling.count('dihedrals', len(plan.dihedrals))
+        profiling.count('selected_atoms', len(plan.used_atoms))
+        return plan
+
+    def preload_atoms(self, torsions=('phi', 'psi', 'omega')):
+        '''returns the sorted indices of the atoms in any dihedral of the given torsion types
+        and the side-chain atoms of the glycosylated ASN residues.'''
+        backbone = ('N', 'HN', 'H', 'CA', 'HA', 'C', 'O')
+        asn = [idx for (residue, name), idx in self.glycan_atom_index().atom_lookup.items()
+               if residue.startswith('ASN_') and name not in backbone]
+        return np.union1d(self.dihedral_plan(torsions).used_atoms, np.asarray(asn, dtype=np.intp))
+
+    def preload(self, traj, frames=None, path=None, torsions=('phi', 'psi', 'omega')):
+        '''Reads the coordinates of only the glycan dihedral and ASN side-chain atoms of traj once into
+        compact GlycanCoordinates (in RAM, or memory-mapped at path), which can be passed as traj to
+        torsion_array, iter_torsions, write_store and all_torsions instead of the Universe.'''
+        return preload_coordinates(traj, self.preload_atoms(torsions), frames, path)
+
+    def use_coordinate_cache(self, cache_dir):
+        '''Reads all later torsion runs on a trajectory from memory-mapped glycan coordinates in
+        cache_dir, extracted from the trajectory on the first run and again whenever the path,
+        size or mtime of the trajectory file changes. None switches the cache off.'''
+        self.coordinate_cache = cache_dir
+
+    def _coordinates(self, traj):
+        '''returns the cached GlycanCoordinates of the Universe traj if a coordinate cache is in use,
+        otherwise traj itself.'''
+        if self.coordinate_cache is None or traj is None or isinstance(traj, coordinate_cache.GlycanCoordinates):
+            return traj
+        atoms = self.preload_atoms()
+        path = coordinate_cache.cache_path(self.coordinate_cache, traj)
+        build = lambda path, metadata: preload_coordinates(traj, atoms, path=path, metadata=metadata)
+        return coordinate_cache.GlycanCoordinates.cached(path, traj, atoms, build)
+
+    def _frame_numbers(self, traj, frames=None):
+        if frames is not None:
+            return np.asarray(frames)
+        if isinstance(traj, coordinate_cache.GlycanCoordinates):
+            return traj.frames
+        return np.arange(len(traj.trajectory))
+
+    def export_plan(self, path, torsions=('phi', 'psi', 'omega')):
+        '''Saves the DihedralPlan of the given torsion types to path (.json or .npz), later runs on the
+        same topology can load it with DihedralPlan.load and pass it to plan_torsion_array.'''
+        plan = self.dihedral_plan(torsions)
+        plan.save(path)
+        return plan
+
+    def dihedral_definitions(self, torsion):
+        '''returns the (n_dihedrals x 4) atom indices of one torsion type, or a list of them, and
+        their (chain, fname) labels, or (chain, fname, torsion) labels for a list of torsion types,
+        where fname is resid2(linkage)resid1, e.g. AMAN4(1-3)BMAN3.'''
+        plan = self.dihedral_plan(torsion)
+        return plan.quadruplets, plan.labels(with_torsion=not isinstance(torsion, str))
+
+    def _dihedral_setup(self, torsion):
+        '''returns the atoms gathered per frame, the dihedrals as (n_dihedrals x 4) indices into
+        them and the column index, (chain, fname) for a single torsion type or
+        (chain, fname, torsion) for a list of torsion types or a DihedralPlan.'''
+        plan = torsion if isinstance(torsion, dihedral_plan.DihedralPlan) else self.dihedral_plan(torsion)
+        return plan.used_atoms, plan.local, plan.columns(with_torsion=not isinstance(torsion, str))
+
+    @measure
+    def torsion_array(self, torsion, traj=None, dtype=np.float32, n_workers=1, frames=None, progress=None):
+        '''Computes one torsion type (or a list of them) for all linkages of all chains in a single
+        pass over the trajectory.
+
+        traj: Universe with the same topology as gro_file, or GlycanCoordinates from preload, if None
+        the angles of the current gro_file frame are returned.
+        n_workers: number of processes, the trajectory is split into n_workers contiguous frame
+        blocks, each opened in its own Universe from the topology and trajectory files of traj.
+        frames: indices of the frames to read, e.g. from select_frames, None reads all frames.
+        progress: None only logs progress events, True prints a progress bar, or a callable called
+        with every event (frames, frames/sec, ETA, RSS), see progress.make_progress.
+        returns an (n_frames x n_dihedrals) array of angles in degrees and a MultiIndex of
+        (chain, fname) labelling the columns.'''
+
+        used_atoms, local, columns = self._dihedral_setup(torsion)
+
+        if traj is None:
+            angles = dihedral_angles(self.gro_file.atoms.positions[used_atoms], local, self.gro_file.dimensions)[None, :]
+            return angles.astype(dtype), columns
+
+        self.traj = traj
+        traj = self._coordinates(traj)
+        progress = progress_report.make_progress(progress, len(self._frame_numbers(traj, frames)))
+        if isinstance(traj, coordinate_cache.GlycanCoordinates):
+            angles = coordinate_block_angles(traj, used_atoms, local, dtype, frames, progress=progress)
+        elif n_workers > 1:
+            angles = parallel_torsion_angles(traj, used_atoms, local, n_workers, dtype, frames, progress)
+        else:
+            angles = frame_block_angles(frame_iterator(traj.trajectory, frames), used_atoms, local, dtype,
+                                        progress=progress)
+        progress.close()
+        return angles, columns
+
+    def _iter_chunks(self, used_atoms, local, traj, chunk_size, dtype, frames=None, progress=None, n_workers=1):
+        '''yields (frames, times, angles) for consecutive chunks of at most chunk_size of the given frames,
+        computed in a pool of n_workers processes if n_workers > 1 and traj is a Universe.'''
+        self.traj = traj
+        traj = self._coordinates(traj)
+        frames = self._frame_numbers(traj, frames)
+        progress = progress_report.make_progress(progress, len(frames))
+        chunks = (np.asarray(frames[start:start + chunk_size]) for start in range(0, len(frames), chunk_size))
+        if n_workers > 1 and not isinstance(traj, coordinate_cache.GlycanCoordinates):
+            yield from parallel_chunks(traj, used_atoms, local, chunks, n_workers, dtype, progress)
+            progress.close()
+            return
+        for chunk in chunks:
+            times = np.empty(len(chunk))
+            if isinstance(traj, coordinate_cache.GlycanCoordinates):
+                angles = coordinate_block_angles(traj, used_atoms, local, dtype, chunk, times, progress)
+            else:
+                angles = frame_block_angles(frame_iterator(traj.trajectory, chunk), used_atoms, local, dtype, times,
+                                            progress)
+            yield chunk, times, angles
+        progress.close()
+
+    def iter_torsions(self, torsion, traj, chunk_size=1000, as_dataframe=False, sink=None, dtype=np.float32, frames=None,
+                      progress=None):
+        '''Generator over fixed-size frame chunks of one torsion type (or a list of them),
+        memory use depends only on chunk_size.
+
+        yields (chunk_size x n_dihedrals) arrays, or DataFrames indexed by frame with (chain, fname)
+        columns if as_dataframe is True; the last chunk may be shorter.
+        sink: path of a .npy file or an object with an append(angles, frames, times) method,
+        e.g. a TorsionStore, every chunk is appended to it as soon as it is computed.
+        frames: indices of the frames to read, e.g. from select_frames, None reads all frames.
+        progress: see torsion_array.'''
+
+        used_atoms, local, columns = self._dihedral_setup(torsion)
+
+        writer = sink
+        if isinstance(sink, (str, os.PathLike)):
+            writer = torsion_store.NpyChunkWriter(sink, len(columns), dtype)
 
+        try:
+            for chunk, times, angles in self._iter_chunks(used_atoms, local, traj, chunk_size, dtype, frames, progress):
+                if writer is not None:
+                    writer.append(angles, chunk, times)
+
+                if as_dataframe:
+                    yield pd.DataFrame(angles, index=pd.Index(chunk, name='frame'), columns=columns)
+                else:
+                    yield angles
+        finally:
+            if writer is not sink:
+                writer.close()
+
+    def write_torsions(self, torsion, traj, sink, chunk_size=1000, dtype=np.float32, frames=None, progress=None):
+        '''Streams one torsion type chunk by chunk into sink (see iter_torsions) without keeping the results.
+        returns the column index of the written columns.'''
+        for _ in self.iter_torsions(torsion, traj, chunk_size, sink=sink, dtype=dtype, frames=frames, progress=progress):
+            pass
+        return self._dihedral_setup(torsion)[2]
+
+    @measure
+    def write_store(self, path, traj, torsions=('phi', 'psi', 'omega'), chunk_size=1000, dtype=np.float32, frames=None,
+                    progress=None, n_workers=1, resume=False):
+        '''Writes the torsions of all linkages of all chains to a columnar TorsionStore at path,
+        with one column per (chain, linkage, torsion), the frame numbers and times of traj and the
+        structure_mapping as provenance. n_workers > 1 computes the chunks in that many processes,
+        they are still written in frame order. Every chunk is checkpointed in the store manifest,
+        resume=True continues an interrupted run at path with the frames not yet in the store,
+        the store must have been written with the same dihedral plan and frames. returns the TorsionStore.'''
+        plan = self.dihedral_plan(list(torsions))
+        used_atoms, local, columns = self._dihedral_setup(plan)
+        if isinstance(traj, coordinate_cache.GlycanCoordinates):
+            source = {'coordinates': str(traj.path)}
+        else:
+            source = {'topology': str(traj.filename),
+                      'trajectory': str(getattr(traj.trajectory, 'filenames', traj.trajectory.filename))}
+
+        structure_mapping = {k: self.glycan_graph(k).structure_mapping(g) for k, g in zip(self.structure_mapping, self.glysites)}
+        frames = self._frame_numbers(traj, frames)
+        store = torsion_store.TorsionStore.create(path, columns, structure_mapping, source, dtype, plan.checksum(),
+                                                  resume, torsion_store.frame_selection(frames))
+        if len(store):
+            frames = frames[~np.isin(frames, store.done_frames())]
+        for chunk, times, angles in self._iter_chunks(used_atoms, local, traj, chunk_size, dtype, frames, progress,
+                                                      n_workers):
+            store.append(angles, chunk, times)
+        return store
+
+    def all_torsions(self, traj=None, torsions=('phi', 'psi', 'omega'), dtype=np.float32, n_workers=1, frames=None,
+                     progress=None):
+        '''Computes phi, psi and omega of all linkages of all chains in one call and one trajectory pass.
+        returns a tidy DataFrame with an angle column indexed by (chain, linkage, torsion, frame).'''
+        angles, columns = self.torsion_array(list(torsions), traj, dtype, n_workers, frames, progress)
+        if traj is None:
+            frames = [self.gro_file.trajectory.frame]
+        else:
+            frames = self._frame_numbers(traj, frames)
+
+        # column-major ravel: all frames of the first dihedral, then the next one
+        n_frames = len(angles)
+        codes = [np.repeat(level_codes, n_frames) for level_codes in columns.codes]
+        codes.append(np.tile(np.arange(n_frames), len(columns)))
+        index = pd.MultiIndex(levels=list(columns.levels) + [pd.Index(np.asarray(frames))],
+                              codes=codes, names=list(columns.names) + ['frame'])
+        return pd.DataFrame({'angle': angles.ravel(order='F')}, index=index)
+
+    @measure
+    def glycan_torsions(self, torsion, traj=None, frames=None, progress=None):
+        '''returns {chain: {fname: angle}} for a single structure, or {chain: {fname: [angles per frame]}}
+        when a trajectory Universe is given, frames selects the frames to read (see select_frames),
+        progress reports the frames processed (see torsion_array).'''
+        angles, columns = self.torsion_array(torsion, traj, dtype=np.float64, frames=frames, progress=progress)
 
-                elif torsion == 'omega':
-                    try:
-                        if i == 0:
-                            torsion_omega = self.calculate_torsions(linkage, torsion)
-
-                            sel2 = structure_mapping_update.iloc[i]['atoms2']
-                            sel1 = structure_mapping_update.iloc[i]['atoms1'][0]
-
-                            atom4 = self.gro_file.select_atoms(f'bynum {sel2[0]}:{sel2[1]} and name {torsion_omega[0]}')
-                            atom3 = self.gro_file.select_atoms(f'{sel1} and name {torsion_omega[1]}')
-                            atom2 = self.gro_file.select_atoms(f'{sel1} and name {torsion_omega[2]}')
-                            atom1 = self.gro_file.select_atoms(f'{sel1} and name {torsion_omega[3]}')
-
-
-                            torsion_group = sum([atom4, atom3, atom2, atom1])
-    #                         print(torsion_group)
-                            tor_angle = torsion_group.dihedral
-
-                            fname = format(structure_mapping_update.iloc[i]['resid2']) + f'({linkage})' + format(structure_mapping_update.iloc[i]['resid1'])
-                            if not traj == None:
-
-                                torsion_value = [tor_angle.value() for ts in self.traj.trajectory]
-                                torsion_angle.update({fname: torsion_value})
-                            else:
-                                torsion_angle.update({fname: tor_angle.value()})
-
-                        else:
-                            torsion_omega = self.calculate_torsions(linkage, torsion)
-
-                            sel2 = structure_mapping_update.iloc[i]['atoms2']
-                            sel1 = structure_mapping_update.iloc[i]['atoms1']
-
-                            atom4 = self.gro_file.select_atoms(f'bynum {sel2[0]}:{sel2[1]} and name {torsion_omega[0]}')
-                            atom3 = self.gro_file.select_atoms(f'bynum {sel1[0]}:{sel1[1]} and name {torsion_omega[1]}')
-                            atom2 = self.gro_file.select_atoms(f'bynum {sel1[0]}:{sel1[1]} and name {torsion_omega[2]}')
-                            atom1 = self.gro_file.select_atoms(f'bynum {sel1[0]}:{sel1[1]} and name {torsion_omega[3]}')
-
-                            torsion_group = sum([atom4, atom3, atom2, atom1])
-    #                         print(torsion_group)
-                            tor_angle = torsion_group.dihedral
-
-                            fname = format(structure_mapping_update.iloc[i]['resid2']) + f'({linkage})' + format(structure_mapping_update.iloc[i]['resid1'])
-                            if not traj == None:
-                                torsion_value = [tor_angle.value() for ts in self.traj.trajectory]
-                                torsion_angle.update({fname: torsion_value})
-                            else:
-                                torsion_angle.update({fname: tor_angle.value()})
-#                         torsions_all.update({k: torsion_angle})
-                    except:
-                        pass
-                torsion_all.update({k: torsion_angle})
-                
+        torsion_all = {}
+        for j, (k, fname) in enumerate(columns):
+            torsion_angle = torsion_all.setdefault(k, {})
+            if traj is not None:
+                torsion_angle.update({fname: angles[:, j].tolist()})
+            else:
+                torsion_angle.update({fname: float(angles[0, j])})
 
         return torsion_all
-
-
-
-        
-
-
@@ -0,0 +1,164 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+
+def source_files(traj):
+    '''returns the trajectory file(s) of the Universe traj as a list of paths.'''
+    filenames = getattr(traj.trajectory, 'filenames', None)
+    if filenames is None:
+        filenames = [traj.trajectory.filename]
+    return [os.path.abspath(str(f)) for f in filenames]
+
+
+def source_stat(paths):
+    '''returns the path, size and mtime of every source file, recorded in a cache to detect changes.'''
+    stats = []
+    for path in paths:
+        st = os.stat(path)
+        stats.append({'path': os.path.abspath(path), 'size': st.st_size, 'mtime': st.st_mtime_ns})
+    return stats
+
+
+def cache_path(cache_dir, traj):
+    '''returns the directory in cache_dir holding the cached coordinates of the trajectory of traj.'''
+    paths = source_files(traj)
+    key = hashlib.sha1('\n'.join(paths).encode()).hexdigest()[:12]
+    return os.path.join(cache_dir, f'{os.path.basename(paths[0])}.{key}')
+
+
+class GlycanCoordinates:
+    '''Coordinates of only the atoms taking part in the glycan dihedrals, for all read frames,
+    in one contiguous (n_frames x n_atoms x 3) float32 array held in RAM or memory-mapped from disk.
+
+    atoms: sorted 0-based atom indices in the full topology, positions[:, i] belongs to atoms[i]
+    frames: trajectory frame number of every row, times: their times in ps
+    dimensions: (n_frames x 6) unit cell of every frame, or None without a box
+
+    Passed in place of a Universe to GlycanTorsions.torsion_array, iter_torsions, write_store or
+    all_torsions, the torsions are computed without touching the original trajectory.'''
+    positions_file = 'positions.npy'
+    metadata_file = 'metadata.json'
+
+    def __init__(self, positions, atoms, frames, times, dimensions=None, path=None):
+        self.positions = positions
+        self.atoms = np.asarray(atoms, dtype=np.intp)
+        self.frames = np.asarray(frames, dtype=np.int64)
+        self.times = np.asarray(times, dtype=np.float64)
+        self.dimensions = dimensions
+        self.path = path
+
+    @classmethod
+    def empty(cls, atoms, frames, path=None):
+        '''Allocates the arrays for frames of atoms, positions are memory-mapped from a new
+        directory at path if given, otherwise held in RAM. Fill with set_frame and save (path) when done.'''
+        atoms = np.unique(np.asarray(atoms, dtype=np.intp))
+        shape = (len(frames), len(atoms), 3)
+        if path is None:
+            positions = np.empty(shape, dtype=np.float32)
+        else:
+            os.makedirs(path, exist_ok=True)
+            positions = np.lib.format.open_memmap(os.path.join(path, cls.positions_file), mode='w+',
+                                                  dtype=np.float32, shape=shape)
+        return cls(positions, atoms, frames, np.full(len(frames), np.nan), np.zeros((len(frames), 6), np.float32), path)
+
+    def set_frame(self, row, ts):
+        '''Copies the used atoms of the MDAnalysis Timestep ts into row.'''
+        self.positions[row] = ts.positions[self.atoms]
+        self.times[row] = ts.time
+        if ts.dimensions is None:
+            self.dimensions = None
+        elif self.dimensions is not None:
+            self.dimensions[row] = ts.dimensions
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, rows):
+        '''Rows by position, slices are views of positions without copying.'''
+        dimensions = None if self.dimensions is None else self.dimensions[rows]
+        return type(self)(self.positions[rows], self.atoms, self.frames[rows], self.times[rows], dimensions, self.path)
+
+    @property
+    def nbytes(self):
+        return self.positions.nbytes
+
+    def columns(self, atoms):
+        '''returns the positions columns of the given topology atom indices.'''
+        atoms = np.asarray(atoms, dtype=np.intp)
+        columns = np.searchsorted(self.atoms, atoms)
+        if np.any(columns >= len(self.atoms)) or np.any(self.atoms[np.minimum(columns, len(self.atoms) - 1)] != atoms):
+            raise ValueError('the coordinates do not hold all atoms of the dihedrals')
+        return columns
+
+    def rows(self, frames=None):
+        '''returns the rows holding the given trajectory frame numbers, all rows if frames is None.'''
+        if frames is None:
+            return np.arange(len(self))
+        frames = np.asarray(frames, dtype=np.int64)
+        order = np.argsort(self.frames)
+        rows = order[np.minimum(np.searchsorted(self.frames, frames, sorter=order), len(order) - 1)]
+        if len(frames) and np.any(self.frames[rows] != frames):
+            raise ValueError('the coordinates do not hold all requested frames')
+        return rows
+
+    def save(self, path=None, **metadata):
+        '''Writes the coordinates to a directory at path (or flushes the memory-mapped ones),
+        any keyword arguments are stored in its metadata.json.'''
+        path = self.path if path is None else path
+        os.makedirs(path, exist_ok=True)
+        positions_path = os.path.join(path, self.positions_file)
+        if isinstance(self.positions, np.memmap) and os.path.abspath(self.positions.filename) == os.path.abspath(positions_path):
+            self.positions.flush()
+        else:
+            np.save(positions_path, self.positions)
+        np.save(os.path.join(path, 'atom.npy'), self.atoms)
+        np.save(os.path.join(path, 'frame.npy'), self.frames)
+        np.save(os.path.join(path, 'time.npy'), self.times)
+        if self.dimensions is not None:
+            np.save(os.path.join(path, 'dimensions.npy'), self.dimensions)
+        elif os.path.exists(os.path.join(path, 'dimensions.npy')):
+            os.remove(os.path.join(path, 'dimensions.npy'))
+        with open(os.path.join(path, self.metadata_file), 'w') as f:
+            json.dump(metadata, f, indent=1)
+        self.path = path
+        return self
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        '''Opens coordinates saved with save, positions are memory-mapped unless mmap_mode is None.'''
+        positions = np.load(os.path.join(path, cls.positions_file), mmap_mode=mmap_mode)
+        dimensions = None
+        if os.path.exists(os.path.join(path, 'dimensions.npy')):
+            dimensions = np.load(os.path.join(path, 'dimensions.npy'))
+        return cls(positions, np.load(os.path.join(path, 'atom.npy')), np.load(os.path.join(path, 'frame.npy')),
+                   np.load(os.path.join(path, 'time.npy')), dimensions, path)
+
+    @classmethod
+    def metadata(cls, path):
+        with open(os.path.join(path, cls.metadata_file)) as f:
+            return json.load(f)
+
+    @classmethod
+    def is_current(cls, path, sources, atoms=()):
+        '''True if the coordinates at path were extracted from the source files as they are now
+        (same paths, sizes and mtimes) and hold all the given atoms.'''
+        try:
+            metadata = cls.metadata(path)
+            cached_atoms = np.load(os.path.join(path, 'atom.npy'))
+            return metadata.get('source') == source_stat(sources) and bool(np.all(np.isin(atoms, cached_atoms)))
+        except (OSError, ValueError):
+            return False
+
+    @classmethod
+    def cached(cls, path, traj, atoms, build):
+        '''Opens the memory-mapped coordinates at path if they are current for the trajectory of traj
+        and hold atoms, otherwise calls build(path, metadata) to extract them again first.'''
+        sources = source_files(traj)
+        if not cls.is_current(path, sources, atoms):
+            # an interrupted extraction must not leave a cache that looks current
+            if os.path.exists(os.path.join(path, cls.metadata_file)):
+                os.remove(os.path.join(path, cls.metadata_file))
+            build(path, {'source': source_stat(sources)})
+        return cls.load(path)
@@ -0,0 +1,86 @@
+import numpy as np
+from iupac_to_mapping import lazy
+
+# numba is only imported, and the kernel compiled, on the first call of the numba path
+HAVE_NUMBA = lazy.is_available('numba')
+
+# the numba path is used when numba is installed, set to False to force the NumPy path
+USE_NUMBA = HAVE_NUMBA
+
+
+def is_orthorhombic(box):
+    '''True if all frames of box [lx, ly, lz, alpha, beta, gamma] have right angles.'''
+    return bool(np.all(np.asarray(box)[..., 3:] == 90.0))
+
+
+def minimum_image(vectors, box):
+    '''Shortest periodic image of (n_frames x n x 3) vectors in (n_frames x 6) boxes.
+    Orthorhombic boxes are handled in NumPy, triclinic ones frame by frame with MDAnalysis.'''
+    if is_orthorhombic(box):
+        lengths = box[:, None, :3]
+        return vectors - lengths * np.floor(vectors / lengths + 0.5)
+
+    from MDAnalysis.lib.distances import minimize_vectors
+    return np.stack([minimize_vectors(v, b.astype(np.float32)) for v, b in zip(vectors, box)])
+
+
+def _as_frames(positions, box):
+    '''returns positions as (n_frames x n_atoms x 3) float64 and box as (n_frames x 6) or None.'''
+    positions = np.asarray(positions, dtype=np.float64)
+    if positions.ndim == 2:
+        positions = positions[None]
+    if box is not None:
+        box = np.asarray(box, dtype=np.float64)
+        if box.ndim == 1:
+            box = np.broadcast_to(box, (len(positions), 6))
+        if np.any(box[:, :3] <= 0):
+            box = None
+    return positions, box
+
+
+def dihedrals_numpy(positions, quadruplets, box=None):
+    '''NumPy path of dihedrals, same arguments and result.'''
+    positions, box = _as_frames(positions, box)
+    quadruplets = np.asarray(quadruplets, dtype=np.intp)
+    p = positions[:, quadruplets]                       # n_frames x n_dihedrals x 4 x 3
+    b1 = p[:, :, 1] - p[:, :, 0]
+    b2 = p[:, :, 2] - p[:, :, 1]
+    b3 = p[:, :, 3] - p[:, :, 2]
+    if box is not None:
+        b1, b2, b3 = (minimum_image(b, box) for b in (b1, b2, b3))
+    n1 = np.cross(b1, b2)
+    n2 = np.cross(b2, b3)
+    m1 = np.cross(b2 / np.linalg.norm(b2, axis=-1)[..., None], n1)
+    x = np.einsum('fij,fij->fi', n1, n2)
+    y = np.einsum('fij,fij->fi', m1, n2)
+    return np.degrees(np.arctan2(y, x))
+
+
+def dihedrals_numba(positions, quadruplets, box=None):
+    '''numba path of dihedrals, same arguments and result, triclinic boxes use the NumPy path.'''
+    if not HAVE_NUMBA:
+        raise ImportError('numba is not installed')
+    from iupac_to_mapping import _numba_kernel
+
+    positions, box = _as_frames(positions, box)
+    if box is not None and not is_orthorhombic(box):
+        return dihedrals_numpy(positions, quadruplets, box)
+    periodic = box is not None
+    if not periodic:
+        box = np.ones((len(positions), 6))
+    return _numba_kernel.dihedrals(np.ascontiguousarray(positions), np.ascontiguousarray(quadruplets, dtype=np.intp),
+                            np.ascontiguousarray(box), periodic)
+
+
+def dihedrals(positions, quadruplets, box=None):
+    '''Batched dihedral kernel, numerically stable atan2 formulation.
+
+    positions: (n_frames x n_atoms x 3) coordinates, or (n_atoms x 3) for a single frame
+    quadruplets: (n_dihedrals x 4) atom indices into positions
+    box: unit cell [lx, ly, lz, alpha, beta, gamma], one for all frames or (n_frames x 6), bond vectors
+    are minimum imaged if given, so glycans split across the periodic boundary give the right angles
+    returns (n_frames x n_dihedrals) float64 angles in degrees in [-180, 180], the same convention as
+    AtomGroup.dihedral.value(). Uses numba if installed (see USE_NUMBA), NumPy otherwise.'''
+    if USE_NUMBA:
+        return dihedrals_numba(positions, quadruplets, box)
+    return dihedrals_numpy(positions, quadruplets, box)
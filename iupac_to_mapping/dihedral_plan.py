@@ -0,0 +1,129 @@
+import json
+import hashlib
+import numpy as np
+from iupac_to_mapping import lazy
+
+pd = lazy.lazy_import('pandas')
+
+PLAN_FORMAT = 'glycan-dihedral-plan'
+PLAN_VERSION = 1
+
+
+def topology_checksum(universe):
+    '''sha256 of the number of atoms and the atom names, residue names and resids of universe,
+    identifies the topology a DihedralPlan was built for.'''
+    atoms = universe.atoms
+    checksum = hashlib.sha256(str(len(atoms)).encode())
+    for values in (atoms.names, atoms.resnames, atoms.resids):
+        checksum.update(np.asarray(values).astype(str).tobytes())
+    return checksum.hexdigest()
+
+
+class DihedralPlan:
+    '''Precomputed definitions of all dihedrals to evaluate per frame, a structured array with one row
+    per dihedral and the fields
+    chain: chain name, e.g. chain I
+    linkage: resid2(linkage)resid1 label, e.g. AMAN4(1-3)BMAN3
+    torsion: phi, psi or omega
+    linkage_type: e.g. 1-4, 2-6, or 1- for the protein-glycan linkage
+    atoms: the four 0-based atom indices of the dihedral
+
+    used_atoms holds the atoms taking part in any dihedral and local the dihedrals as indices
+    into used_atoms, which is all the per-frame kernel needs.
+    topology_checksum identifies the topology the atom indices refer to, see check_topology.'''
+    def __init__(self, dihedrals, topology_checksum=None):
+        self.dihedrals = dihedrals
+        self.topology_checksum = topology_checksum
+        used_atoms, local = np.unique(dihedrals['atoms'], return_inverse=True)
+        self.used_atoms = used_atoms
+        self.local = local.reshape(-1, 4)
+
+    @classmethod
+    def from_records(cls, chains, linkages, torsions, linkage_types, atoms, topology_checksum=None):
+        '''Builds the plan from per-dihedral lists, the string fields are sized to their longest entry.'''
+        fields = [('chain', chains), ('linkage', linkages), ('torsion', torsions), ('linkage_type', linkage_types)]
+        dtype = [(name, f'U{max([len(v) for v in values], default=1)}') for name, values in fields]
+        dtype.append(('atoms', np.intp, (4,)))
+
+        dihedrals = np.empty(len(atoms), dtype=dtype)
+        for name, values in fields:
+            dihedrals[name] = values
+        dihedrals['atoms'] = np.asarray(atoms, dtype=np.intp).reshape(-1, 4)
+        return cls(dihedrals, topology_checksum)
+
+    def __len__(self):
+        return len(self.dihedrals)
+
+    def __repr__(self):
+        return f'DihedralPlan({len(self)} dihedrals, {len(self.used_atoms)} atoms)'
+
+    @property
+    def quadruplets(self):
+        return self.dihedrals['atoms']
+
+    def labels(self, with_torsion=True):
+        '''returns [(chain, linkage, torsion), ...] or [(chain, linkage), ...]'''
+        fields = ['chain', 'linkage', 'torsion'] if with_torsion else ['chain', 'linkage']
+        return list(zip(*(self.dihedrals[f].tolist() for f in fields)))
+
+    def columns(self, with_torsion=True):
+        '''returns the labels as MultiIndex, the column index of the angle arrays.'''
+        names = ['chain', 'linkage', 'torsion'] if with_torsion else ['chain', 'linkage']
+        return pd.MultiIndex.from_tuples(self.labels(with_torsion), names=names)
+
+    def select(self, chain=None, linkage=None, torsion=None):
+        '''returns the plan of the dihedrals matching the given labels (None matches everything).'''
+        mask = np.ones(len(self), dtype=bool)
+        for field, value in (('chain', chain), ('linkage', linkage), ('torsion', torsion)):
+            if value is not None:
+                mask &= np.isin(self.dihedrals[field], [value] if isinstance(value, str) else list(value))
+        return DihedralPlan(self.dihedrals[mask], self.topology_checksum)
+
+    def checksum(self):
+        '''sha256 of the labels and atom indices of all dihedrals and the topology checksum, identifies
+        the plan the columns of a TorsionStore were computed with.'''
+        checksum = hashlib.sha256(str(self.topology_checksum).encode())
+        fields = ('chain', 'linkage', 'torsion', 'linkage_type')
+        checksum.update(json.dumps([self.dihedrals[field].tolist() for field in fields]).encode())
+        checksum.update(np.ascontiguousarray(self.quadruplets, dtype=np.int64).tobytes())
+        return checksum.hexdigest()
+
+    def check_topology(self, universe):
+        '''Raises ValueError if universe does not have the topology the plan was built for.'''
+        if self.topology_checksum is None:
+            return
+        if topology_checksum(universe) != self.topology_checksum:
+            raise ValueError('the dihedral plan was built for a different topology '
+                             f'({len(universe.atoms)} atoms, checksum mismatch)')
+
+    def save(self, path):
+        '''Writes the plan to path, as JSON if path ends with .json, otherwise as NPZ.'''
+        if str(path).endswith('.json'):
+            plan = {'format': PLAN_FORMAT,
+                    'version': PLAN_VERSION,
+                    'topology_checksum': self.topology_checksum,
+                    'dihedrals': {field: self.dihedrals[field].tolist() for field in self.dihedrals.dtype.names}}
+            with open(path, 'w') as f:
+                json.dump(plan, f)
+        else:
+            # through a file handle, np.savez would otherwise add .npz to a path without that suffix
+            with open(path, 'wb') as f:
+                np.savez(f, dihedrals=self.dihedrals, format=PLAN_FORMAT, version=PLAN_VERSION,
+                         topology_checksum=self.topology_checksum or '')
+
+    @classmethod
+    def load(cls, path):
+        '''Reads a plan written by save.'''
+        if str(path).endswith('.json'):
+            with open(path) as f:
+                plan = json.load(f)
+            if plan.get('format') != PLAN_FORMAT:
+                raise ValueError(f'{path} is not a dihedral plan')
+            d = plan['dihedrals']
+            return cls.from_records(d['chain'], d['linkage'], d['torsion'], d['linkage_type'], d['atoms'],
+                                    plan['topology_checksum'])
+
+        with np.load(path) as plan:
+            if str(plan['format']) != PLAN_FORMAT:
+                raise ValueError(f'{path} is not a dihedral plan')
+            return cls(plan['dihedrals'], str(plan['topology_checksum']) or None)
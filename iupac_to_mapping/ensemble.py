@@ -0,0 +1,219 @@
+import os
+import json
+import shutil
+import traceback
+from time import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from iupac_to_mapping import compute_torsions
+from iupac_to_mapping import torsion_store
+from iupac_to_mapping import profiling
+from iupac_to_mapping import progress as progress_report
+from iupac_to_mapping import lazy
+
+pd = lazy.lazy_import('pandas')
+mda = lazy.lazy_import('MDAnalysis')
+
+
+def _open_replica(topology, trajectory, plan, frames, skip=()):
+    '''returns the Universe of a replica and the frame numbers to compute, without those in skip.'''
+    with profiling.stage('trajectory_io'):
+        u = mda.Universe(topology, trajectory)
+    plan.check_topology(u)
+    if frames is None or isinstance(frames, slice):
+        frames = np.arange(len(u.trajectory))[frames or slice(None)]
+    frames = np.asarray(frames)
+    if len(skip):
+        frames = frames[~np.isin(frames, skip)]
+    return u, frames
+
+
+def _replica_torsions(topology, trajectory, plan, dtype, frames):
+    '''Worker: computes the dihedrals of plan over one replica trajectory.
+    returns (frame numbers, times, (n_frames x n_dihedrals) angles), the number of frames, seconds
+    and profiling report.'''
+    start = time()
+    profiling.profiler.reset()
+    u, frames = _open_replica(topology, trajectory, plan, frames)
+    times = np.empty(len(frames))
+    angles = compute_torsions.frame_block_angles(compute_torsions.frame_iterator(u.trajectory, frames),
+                                                 plan.used_atoms, plan.local, dtype, times)
+    return (frames, times, angles), len(frames), time() - start, profiling.profiler.report()
+
+
+def _replica_blocks(topology, trajectory, plan, dtype, frames, skip, spool, chunk_size, replica):
+    '''Worker: computes the dihedrals of plan over one replica trajectory chunk_size frames at a time,
+    each chunk saved to an .npz file (frames, times, angles) in the spool directory, so neither the
+    worker nor the process writing the store holds the whole replica. Frames in skip are not computed.
+    returns the chunk files in frame order, the number of frames, seconds and profiling report.'''
+    start = time()
+    profiling.profiler.reset()
+    u, frames = _open_replica(topology, trajectory, plan, frames, skip)
+    files = []
+    for i in range(0, len(frames), chunk_size):
+        block = frames[i:i + chunk_size]
+        times = np.empty(len(block))
+        angles = compute_torsions.frame_block_angles(compute_torsions.frame_iterator(u.trajectory, block),
+                                                     plan.used_atoms, plan.local, dtype, times)
+        path = os.path.join(spool, f'replica{replica:06d}_{len(files):06d}.npz')
+        with open(path, 'wb') as f:
+            np.savez(f, frames=block, times=times, angles=angles)
+        files.append(path)
+    return files, len(frames), time() - start, profiling.profiler.report()
+
+
+class EnsembleRunner:
+    '''Computes the torsions of one DihedralPlan over many replica trajectories of the same topology,
+    each replica in its own worker process.
+
+    topology: topology file shared by all replicas
+    trajectories: list of trajectory files, replica i is trajectories[i]
+    plan: DihedralPlan, e.g. from GlycanTorsions.dihedral_plan or DihedralPlan.load
+    n_workers: number of processes, None uses one per CPU
+    frames: frame indices read from every replica (see compute_torsions.select_frames), or a slice
+    applied to the frames of each replica, None reads all
+    progress: called with a progress event per finished or failed replica (frames, frames/sec, ETA
+    and RSS of the whole ensemble, see progress.Progress, plus replica, trajectory, status,
+    replica_frames, replica_seconds or error, replicas_done and replicas_total). None only logs the
+    events to the iupac_to_mapping.progress logger, True prints one line per replica on stderr
+    (progress.print_replica_progress), a callable is called with every event, which is also logged.
+    max_restarts: how often the unfinished replicas are submitted again after a worker process died,
+    each in a pool of its own, the replicas still unfinished after that are failed'''
+    def __init__(self, topology, trajectories, plan, n_workers=None, dtype=np.float32, frames=None,
+                 progress=None, max_restarts=3):
+        self.topology = topology
+        self.trajectories = list(trajectories)
+        self.plan = plan
+        self.n_workers = n_workers
+        self.dtype = dtype
+        self.frames = frames
+        self.progress = progress
+        self.max_restarts = max_restarts
+        self.failed = {}
+
+    def _run_tasks(self, tasks, replicas, isolated=False):
+        '''Runs the tasks of replicas in worker processes. yields (replica, result, error) as they finish,
+        error is the exception of a failed replica, a BrokenProcessPool if its worker process died.
+        isolated runs every replica in a pool of its own (at most n_workers at a time), so a dying
+        worker process only breaks the pool of its replica.'''
+        if isolated:
+            n_pools = self.n_workers or os.cpu_count() or 1
+            waves = [[[r] for r in replicas[i:i + n_pools]] for i in range(0, len(replicas), n_pools)]
+        else:
+            waves = [[list(replicas)]]
+        for wave in waves:
+            executors = [ProcessPoolExecutor(max_workers=1 if isolated else self.n_workers) for _ in wave]
+            try:
+                futures = {}
+                for executor, group in zip(executors, wave):
+                    for r in group:
+                        try:
+                            futures[executor.submit(tasks[r][0], *tasks[r][1])] = r
+                        except BrokenProcessPool as e:
+                            yield r, None, e
+                for future in as_completed(futures):
+                    try:
+                        yield futures[future], future.result(), None
+                    except Exception as e:
+                        yield futures[future], None, e
+            finally:
+                for executor in executors:
+                    executor.shutdown()
+
+    def _results(self, tasks):
+        '''tasks: {replica: (worker, args)}, runs them in the worker processes and
+        yields (replica, result) as replicas finish, failures are reported and kept in self.failed
+        without stopping the other replicas. A worker process that dies (e.g. killed when out of memory)
+        breaks the whole pool, the unfinished replicas are then submitted again, each in a pool of its own,
+        so that only a replica that kills its worker every time fails, after max_restarts attempts.'''
+        self.failed = {}
+        n_replicas = len(tasks)
+        total = None if self.frames is None or isinstance(self.frames, slice) else len(self.frames) * n_replicas
+        callback = progress_report.print_replica_progress if self.progress is True else self.progress or None
+        progress = progress_report.Progress(total, callback, 'ensemble', interval=0)
+        completed = 0
+
+        def report(r, status, **fields):
+            event = {'replica': r, 'trajectory': str(self.trajectories[r]), 'status': status,
+                     'replicas_done': completed, 'replicas_total': n_replicas}
+            if total is None:
+                # the number of frames of the replicas is unknown until they are read
+                elapsed = progress.event()['elapsed_seconds']
+                event['eta_seconds'] = elapsed / completed * (n_replicas - completed)
+            event.update(fields)
+            progress.update(fields.get('replica_frames', 0), **event)
+
+        unfinished = list(tasks)
+        errors = {}
+        for attempt in range(self.max_restarts + 1):
+            broken = []
+            for r, result, error in self._run_tasks(tasks, unfinished, isolated=attempt > 0):
+                if isinstance(error, BrokenProcessPool):
+                    broken.append(r)
+                    errors[r] = error
+                    continue
+                completed += 1
+                if error is not None:
+                    self.failed[r] = ''.join(traceback.format_exception_only(type(error), error)).strip()
+                    report(r, 'failed', error=self.failed[r])
+                    continue
+
+                data, n_frames, seconds, profile = result
+                profiling.profiler.merge(profile)
+                report(r, 'done', replica_frames=n_frames, replica_seconds=seconds)
+                yield r, data
+
+            unfinished = sorted(broken)
+            if not unfinished or attempt == self.max_restarts:
+                break
+            progress_report.logger.warning(json.dumps({'event': 'pool_restart', 'attempt': attempt + 1,
+                                                       'replicas': unfinished}))
+        for r in unfinished:
+            completed += 1
+            self.failed[r] = ''.join(traceback.format_exception_only(type(errors[r]), errors[r])).strip()
+            report(r, 'failed', error=self.failed[r])
+        progress.close(replicas_done=n_replicas - len(self.failed), replicas_total=n_replicas,
+                       replicas_failed=sorted(self.failed))
+
+    def run(self):
+        '''returns {replica: DataFrame indexed by frame with (chain, linkage, torsion) columns} of the
+        replicas that finished, failed replicas are in self.failed.'''
+        columns = self.plan.columns()
+        tasks = {r: (_replica_torsions, (self.topology, trajectory, self.plan, self.dtype, self.frames))
+                 for r, trajectory in enumerate(self.trajectories)}
+        results = {}
+        for r, (frames, times, angles) in self._results(tasks):
+            results[r] = pd.DataFrame(angles, index=pd.Index(frames, name='frame'), columns=columns)
+        return dict(sorted(results.items()))
+
+    def write_store(self, path, structure_mapping=None, resume=False, chunk_size=1000):
+        '''Merges all replicas into one TorsionStore at path with a replica number per row.
+        The workers compute chunk_size frames at a time and spool them to disk, every chunk is then
+        appended and checkpointed as a block of the store, the replica is committed after its last one.
+        resume=True continues an interrupted run at path written with the same plan and frames:
+        committed replicas are skipped and the others continue after their frames already in the store.
+        returns the store, failed replicas are in self.failed.'''
+        source = {'topology': str(self.topology), 'replicas': [str(t) for t in self.trajectories]}
+        store = torsion_store.TorsionStore.create(path, self.plan.columns(), structure_mapping, source, self.dtype,
+                                                  self.plan.checksum(), resume,
+                                                  torsion_store.frame_selection(self.frames))
+        spool = os.path.join(path, 'spool')
+        # chunks spooled by an interrupted run were never committed
+        shutil.rmtree(spool, ignore_errors=True)
+        os.makedirs(spool)
+
+        done = set(store.done_replicas)
+        tasks = {}
+        for r, trajectory in enumerate(self.trajectories):
+            if r not in done:
+                tasks[r] = (_replica_blocks, (self.topology, trajectory, self.plan, self.dtype, self.frames,
+                                              np.array(store.done_frames(r)), spool, chunk_size, r))
+        for r, files in self._results(tasks):
+            for file in files:
+                with np.load(file) as block:
+                    store.append(block['angles'], block['frames'], block['times'], replica=r)
+                os.remove(file)
+            store.commit_replica(r)
+        shutil.rmtree(spool, ignore_errors=True)
+        return store
@@ -1,43 +1,86 @@
-import pandas as pd
 import numpy as np
 import os
 import itertools 
 from iupac_to_mapping import string_process
 from iupac_to_mapping import iupac_converter
+from iupac_to_mapping import profiling
+from iupac_to_mapping import lazy
+
+pd = lazy.lazy_import('pandas')
+
+
+def chain_id(number):
+    '''Roman numeral chain id, 1 -> I, 4 -> IV, 38 -> XXXVIII'''
+    numerals = [(1000, 'M'), (900, 'CM'), (500, 'D'), (400, 'CD'), (100, 'C'), (90, 'XC'),
+                (50, 'L'), (40, 'XL'), (10, 'X'), (9, 'IX'), (5, 'V'), (4, 'IV'), (1, 'I')]
+    roman = ''
+    for value, numeral in numerals:
+        count, number = divmod(number, value)
+        roman += numeral * count
+    return roman
+
 
-    
 class GlycanStructure:
     def __init__(self, atom_selection, core_list):
         self.atom_selection = atom_selection
         self.core_list = core_list
 
+    @profiling.timed('index_discovery')
     def find_indices(self):
-        indices = []                   # original indices where the glycan chain begins 
-        atom_indices = []              # glycan residue and their atom slice info e.g. (bglcn1, [4440, 4445]), 4440 is the atom index of the first atom of bglcn1, and 4445 is the last 
-        core_index = 0
-        core_glycan_res =  self.core_list          # this is N-glycan core
-        glycans_resnames = [x for x in self.atom_selection.residues.resnames]
-        glycan_residues_all = [x for x in self.atom_selection.residues]
-
-        for i, item in enumerate(glycans_resnames):
-            atom_indices.append((f'{item}{i+1}', [self.atom_selection.residues[i].atoms[0].id, self.atom_selection.residues[i].atoms[-1].id]))
-            if item == core_glycan_res[core_index]:
-                core_index += 1
-                if core_index == len(core_glycan_res):
-                    indices.append(i - len(core_glycan_res) + 1)
-                    core_index = 0
-            else:
-                core_index = 0
+        '''returns the positions of the residues where each glycan chain begins (indices), their
+        residue indices (res_indices), the residues of each chain (sublists) and the per-chain
+        residue label / atom slice info (sublists_atom_selection), e.g. (BGLCN1, [4440, 4445]) where
+        4440 is the atom number of the first atom of BGLCN1 and 4445 of the last one.'''
+        glycan_residues_all = self.atom_selection.residues
+        glycans_resnames = np.asarray(glycan_residues_all.resnames).astype(str)
+        core_glycan_res = np.asarray(self.core_list).astype(str)          # this is N-glycan core
+        n_core = len(core_glycan_res)
+
+        # first and last atom of every residue, from the residue boundaries of the concatenated atoms
+        atoms = glycan_residues_all.atoms
+        starts = np.flatnonzero(np.r_[True, np.diff(atoms.resindices) != 0])
+        ends = np.r_[starts[1:], len(atoms)] - 1
+        first_ids = atoms.ids[starts].tolist()
+        last_ids = atoms.ids[ends].tolist()
+        labels = np.char.add(glycans_resnames, np.arange(1, len(glycans_resnames) + 1).astype(str)).tolist()
+        atom_indices = [(label, [first, last]) for label, first, last in zip(labels, first_ids, last_ids)]
+
+        # sliding window match of the core motif, overlapping matches are dropped
+        indices = []
+        if len(glycans_resnames) >= n_core:
+            windows = np.lib.stride_tricks.sliding_window_view(glycans_resnames, n_core)
+            for i in np.flatnonzero((windows == core_glycan_res).all(axis=1)).tolist():
+                if not indices or i >= indices[-1] + n_core:
+                    indices.append(i)
+
+        bounds = indices + [len(glycans_resnames)]
         res_indices = [x + 1 + glycan_residues_all[0].resindex for x in indices]
-        sublists = [glycan_residues_all[indices[i]:indices[i+1]] if i+1 < len(indices) else glycan_residues_all[indices[i]:] for i in range(len(indices))]
-        sublists_atom_selection = [atom_indices[indices[i]:indices[i+1]] if i+1 < len(indices) else atom_indices[indices[i]:] for i in range(len(indices))]
+        sublists = [glycan_residues_all[bounds[i]:bounds[i+1]] for i in range(len(indices))]
+        sublists_atom_selection = [atom_indices[bounds[i]:bounds[i+1]] for i in range(len(indices))]
+        profiling.count('glycan_chains', len(indices))
+        profiling.count('glycan_residues', len(glycans_resnames))
         return indices, res_indices, sublists, sublists_atom_selection
 
     def glycan_chains(self, g_sublists):
+        '''returns {'chain I': AtomGroup, 'chain II': ..., } with the atoms of atom_selection in each
+        glycan chain of find_indices, for any number of chains. All chains are split off in one pass.'''
+        resindices = [np.asarray(getattr(sublist, 'resindices', [r.resindex for r in sublist]), dtype=np.intp)
+                      for sublist in g_sublists]
+        if not resindices:
+            return {}
+
+        # chain number of every residue, then of every atom in the selection
+        residue_chain = np.full(len(self.atom_selection.universe.residues), -1)
+        residue_chain[np.concatenate(resindices)] = np.repeat(np.arange(len(resindices)), [len(r) for r in resindices])
+        atom_chain = residue_chain[self.atom_selection.resindices]
+
+        order = np.argsort(atom_chain, kind='stable')
+        bounds = np.searchsorted(atom_chain[order], np.arange(len(resindices) + 1))
+
         glycan_chainatom_selection_dict = {}
-        for i, sublist in zip(['I', 'II', 'III', 'IV', 'V'], g_sublists):
-            chain_atom_selection = self.atom_selection.select_atom_selection('resid ' + str(sublist[0].resid) + ':' + str(sublist[-1].resid))
-            glycan_chainatom_selection_dict.update({'chain ' + str(i): chain_atom_selection})
+        for i in range(len(resindices)):
+            chain_atom_selection = self.atom_selection[order[bounds[i]:bounds[i+1]]]
+            glycan_chainatom_selection_dict.update({'chain ' + chain_id(i + 1): chain_atom_selection})
         return glycan_chainatom_selection_dict
 
     @staticmethod
@@ -47,4 +90,76 @@ class GlycanStructure:
             return 'α-' + g_res_dict.get(glycan_res[1:])
         elif glycan_res[:1] == 'B':
             return 'β-' + g_res_dict.get(glycan_res[1:])
-        
\ No newline at end of file
+        
+
+class GlycanAtomIndex:
+    '''(residue label, atom name) -> atom index lookup table, built once from the Universe topology.
+
+    universe: the Universe the find_indices residues refer to
+    atom_indices: output of GlycanStructure.find_indices, the atoms of every glycan residue are taken
+    from its residues (atom_indices[2]) by index and stored under its label in atom_indices[3]
+    glysites: resids of the glycosylated ASN residues, one per glycan chain. The atoms of the ASN of
+    chain i are stored under asn_labels[i], ASN_<resindex>; if several ASN residues have the resid,
+    e.g. in the protomers of a multimer, the one whose ND2 is nearest to C1 of the reducing end is used.
+    Raises ValueError if there is no ASN residue with the resid of a glysite.
+    chains: names of the glycan chains, used in error messages
+    '''
+    @profiling.timed('index_discovery')
+    def __init__(self, universe, atom_indices, glysites=(), chains=None):
+        self.atom_lookup = {}
+        self.asn_labels = []
+        names = universe.atoms.names
+
+        for residues, chain in zip(atom_indices[2], atom_indices[3]):
+            for residue, (label, _) in zip(residues, chain):
+                for idx in residue.atoms.indices.tolist():
+                    self.atom_lookup.setdefault((label, names[idx]), idx)
+
+        asn = universe.residues[np.asarray(universe.residues.resnames).astype(str) == 'ASN']
+        for chain, site in enumerate(glysites):
+            candidates = asn[asn.resids == site]
+            if len(candidates) == 0:
+                name = chains[chain] if chains is not None else f'glycan chain {chain + 1}'
+                raise ValueError(f'{name} is attached to resid {site}, which is not an ASN residue')
+            reducing_end = atom_indices[2][chain][0] if chain < len(atom_indices[2]) else None
+            residue = candidates[self._nearest(candidates, reducing_end)]
+            label = f'ASN_{residue.resindex}'
+            for idx in residue.atoms.indices.tolist():
+                self.atom_lookup.setdefault((label, names[idx]), idx)
+            self.asn_labels.append(label)
+        profiling.count('atom_lookups', len(self.atom_lookup))
+
+    @staticmethod
+    def _nearest(candidates, reducing_end):
+        '''returns the position of the ASN residue in candidates whose ND2 is nearest to C1 of the
+        reducing end residue, 0 if there is a single candidate or no coordinates to decide by.'''
+        if len(candidates) == 1 or reducing_end is None:
+            return 0
+        c1 = reducing_end.atoms.select_atoms('name C1')
+        nd2 = [residue.atoms.select_atoms('name ND2') for residue in candidates]
+        if len(c1) == 0 or any(len(atoms) == 0 for atoms in nd2):
+            return 0
+        try:
+            distances = [np.linalg.norm(atoms.positions[0] - c1.positions[0]) for atoms in nd2]
+        except ValueError:
+            # NoDataError, a topology without coordinates
+            return 0
+        return int(np.argmin(distances))
+
+    def asn_label(self, chain):
+        '''returns the lookup label of the ASN residue of glycan chain number chain (0-based), or None.'''
+        return self.asn_labels[chain] if chain < len(self.asn_labels) else None
+
+    def __len__(self):
+        return len(self.atom_lookup)
+
+    def index(self, residue, name):
+        '''returns the 0-based index of atom name in residue, or None if it does not exist.'''
+        return self.atom_lookup.get((residue, name))
+
+    def quadruplet(self, residues, names):
+        '''Resolves four (residue, atom name) pairs to atom indices, returns None if any atom is missing.'''
+        quad = [self.atom_lookup.get(key) for key in zip(residues, names)]
+        if None in quad:
+            return None
+        return quad
@@ -0,0 +1,265 @@
+import re
+import numpy as np
+from iupac_to_mapping import profiling
+from iupac_to_mapping import lazy
+
+pd = lazy.lazy_import('pandas')
+
+# linkage inside the brackets, e.g. b1-4, a2-6, or b1- for the reducing end attached to ASN
+LINKAGE = re.compile(r'([ab?])(\d+)-(\d*)')
+
+# GROMACS/PyMol residue names, see GlycanAnalyzer.get_label_dict
+PDB_RESNAMES = {'GlcNAc': 'GLCN', 'Man': 'MAN', 'Gal': 'GAL', 'Neu5Ac': 'NE5A', 'D-Fuc': 'FUC', 'Fuc': 'FUC'}
+
+# residue type codes of GlycanGraph, RESIDUE_NAMES[code] and PDB_CODES[code]
+RESIDUE_NAMES = ('GlcNAc', 'Man', 'Gal', 'Neu5Ac', 'D-Fuc')
+PDB_CODES = tuple(PDB_RESNAMES[name] for name in RESIDUE_NAMES)
+RESIDUE_CODES = {name: PDB_CODES.index(code) for name, code in PDB_RESNAMES.items()}
+PDB_RESIDUE_CODES = {code: i for i, code in enumerate(PDB_CODES)}
+
+
+class GlycanNode:
+    '''A monosaccharide residue in the glycan tree, the edge to its parent is its glycosidic linkage.
+    name: IUPAC residue name, e.g. GlcNAc, anomer: 'a' or 'b',
+    donor/acceptor: carbon numbers of the linkage, acceptor is None for the reducing end attached to ASN,
+    number: residue number in the chain (1 for the reducing end)'''
+    __slots__ = ('name', 'anomer', 'donor', 'acceptor', 'parent', 'children', 'number')
+
+    def __init__(self, name, anomer, donor, acceptor):
+        self.name = name
+        self.anomer = anomer
+        self.donor = donor
+        self.acceptor = acceptor
+        self.parent = None
+        self.children = []
+        self.number = None
+
+    def __repr__(self):
+        return f'GlycanNode({self.label}, {self.linkage})'
+
+    @property
+    def label(self):
+        '''triplet label, e.g. B-GlcNAc1, A-Neu5Ac7, A-D-Fuc15'''
+        return f'{self.anomer.upper()}-{self.name}{self.number}'
+
+    @property
+    def linkage(self):
+        '''e.g. 1-4, or 1- for the reducing end'''
+        return f'{self.donor}-{"" if self.acceptor is None else self.acceptor}'
+
+
+class GlycanTree:
+    '''Glycan as an explicit tree, nodes are residues and edges linkages.
+    Residues are numbered in depth-first order from the reducing end, the unbracketed (main)
+    child of a residue before its bracketed branches, the numbering used by the
+    GlycanProcessor/GlycanAnalyzer pipeline.'''
+    def __init__(self, root):
+        self.root = root
+        self.nodes = []
+
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            self.nodes.append(node)
+            node.number = len(self.nodes)
+            stack.extend(reversed(node.children))
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def triplets(self, site):
+        '''returns [[glycan2, linkage, glycan1], ...] in residue order, the format of the
+        GlycanAnalyzer maincore_dict, e.g. ['A-Man4', '1-3', 'B-Man3'].'''
+        return [[node.label, node.linkage, f'N{site}' if node.parent is None else node.parent.label]
+                for node in self.nodes]
+
+    def to_graph(self, site=None):
+        '''returns the array-backed GlycanGraph of the tree.'''
+        return GlycanGraph.from_tree(self, site)
+
+    @profiling.timed('mapping')
+    def structure_mapping(self, site):
+        '''returns the structure mapping DataFrame (glycan2, index2, linkage, glycan1, index1)
+        of the glycan attached to ASN site, as GlycanAnalyzer.structure_mapping.'''
+        return self.to_graph(site).structure_mapping()
+
+
+class GlycanGraph:
+    '''Compact array representation of a glycan, residue i (residue number i + 1) is described by
+    residue_type: code into RESIDUE_NAMES / PDB_CODES, anomer: 0 for alpha, 1 for beta,
+    donor/acceptor: carbon numbers of the linkage to its parent, acceptor 0 for the reducing end,
+    parent: index of the parent residue, -1 for the reducing end attached to ASN site.'''
+    __slots__ = ('residue_type', 'anomer', 'donor', 'acceptor', 'parent', 'site')
+
+    def __init__(self, residue_type, anomer, donor, acceptor, parent, site=None):
+        self.residue_type = np.asarray(residue_type, dtype=np.int8)
+        self.anomer = np.asarray(anomer, dtype=np.int8)
+        self.donor = np.asarray(donor, dtype=np.int8)
+        self.acceptor = np.asarray(acceptor, dtype=np.int8)
+        self.parent = np.asarray(parent, dtype=np.int32)
+        self.site = site
+
+    def __len__(self):
+        return len(self.parent)
+
+    @classmethod
+    def from_tree(cls, tree, site=None):
+        nodes = tree.nodes
+        for node in nodes:
+            if node.name not in RESIDUE_CODES:
+                raise ValueError(f'no residue name known for {node.name}')
+            if node.anomer not in ('a', 'b'):
+                # the PDB residue names (AMAN, BGLCN, ...) have no label for an unknown anomer
+                raise ValueError(f'unknown anomer of {node.name}{node.number} ({node.anomer}{node.linkage}), '
+                                 'a or b is needed for its residue name')
+        return cls([RESIDUE_CODES[node.name] for node in nodes],
+                   [node.anomer == 'b' for node in nodes],
+                   [node.donor for node in nodes],
+                   [node.acceptor or 0 for node in nodes],
+                   [-1 if node.parent is None else node.parent.number - 1 for node in nodes],
+                   site)
+
+    @classmethod
+    def from_mapping(cls, mapping):
+        '''Builds the graph from a structure mapping DataFrame, its rows must be in residue order.'''
+        linkage = mapping['linkage'].str.split('-', expand=True)
+        index1 = mapping['index1'].astype(int).to_numpy()
+        parent = index1 - 1
+        parent[0] = -1
+        return cls([PDB_RESIDUE_CODES[g[1:]] for g in mapping['glycan2']],
+                   [g[0] == 'B' for g in mapping['glycan2']],
+                   linkage[0].astype(int),
+                   linkage[1].replace('', '0').astype(int),
+                   parent,
+                   int(index1[0]))
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, a).nbytes for a in ('residue_type', 'anomer', 'donor', 'acceptor', 'parent'))
+
+    def residue_labels(self):
+        '''returns the PDB labels of all residues, e.g. BGLCN, AMAN.'''
+        pdb = np.array([a + c for a in 'AB' for c in PDB_CODES])
+        return pdb[self.anomer * len(PDB_CODES) + self.residue_type]
+
+    def linkages(self):
+        '''returns the linkage labels of all residues, e.g. 1-4, 2-6, 1- for the reducing end.'''
+        return [f'{d}-{a}' if a else f'{d}-' for d, a in zip(self.donor.tolist(), self.acceptor.tolist())]
+
+    def structure_mapping(self, site=None):
+        '''returns the structure mapping DataFrame (glycan2, index2, linkage, glycan1, index1), as GlycanAnalyzer.structure_mapping.'''
+        site = self.site if site is None else site
+        labels = self.residue_labels()
+        root = self.parent < 0
+        glycan1 = np.where(root, 'ASN', labels[self.parent])
+        index1 = np.where(root, str(site), (self.parent + 1).astype(str))
+
+        rows = zip(labels.tolist(), np.arange(1, len(self) + 1).astype(str).tolist(), self.linkages(),
+                   glycan1.tolist(), index1.tolist())
+        gchain_df = pd.DataFrame(dict(enumerate(rows))).T
+        gchain_df.columns = ['glycan2', 'index2', 'linkage', 'glycan1', 'index1']
+        return gchain_df
+
+
+def as_graph(mapping):
+    '''returns mapping as GlycanGraph, mapping is a GlycanGraph, GlycanTree or structure mapping DataFrame.'''
+    if isinstance(mapping, GlycanGraph):
+        return mapping
+    if isinstance(mapping, GlycanTree):
+        return mapping.to_graph()
+    return GlycanGraph.from_mapping(mapping)
+
+
+def _parse_residue(text, end, reducing_end):
+    '''Parses the residue Name(linkage) ending at text[end], returns the node and the position of its first character.
+    The reducing end is linked to ASN: its linkage has no acceptor, e.g. GlcNAc(b1- or GlcNAc(b1-), or it is
+    given without linkage (free reducing end), e.g. GlcNAc, which is read as GlcNAc(b1-.'''
+    if reducing_end and text[end - 1] != ')':
+        name_start = end
+        while name_start > 0 and text[name_start - 1] not in '()[]':
+            name_start -= 1
+        if name_start < end and (name_start == 0 or text[name_start - 1] != '('):
+            return GlycanNode(text[name_start:end], 'b', 1, None), name_start
+
+    if text[end - 1] == ')':
+        close = end - 1
+    elif reducing_end:
+        close = end                      # the reducing end linkage may be left open, e.g. GlcNAc(b1-
+    else:
+        raise ValueError(f'expected ")" at position {end - 1} of {text}')
+
+    start = text.rfind('(', 0, close)
+    match = LINKAGE.fullmatch(text, start + 1, close) if start >= 0 else None
+    if match is None:
+        raise ValueError(f'invalid linkage before position {close} of {text}')
+
+    name_start = start
+    while name_start > 0 and text[name_start - 1] not in '()[]':
+        name_start -= 1
+    if name_start == start:
+        raise ValueError(f'missing residue name before position {start} of {text}')
+
+    anomer, donor, acceptor = match.groups()
+    if close == end and acceptor:
+        raise ValueError(f'missing ")" at the end of {text}')
+    if reducing_end and acceptor:
+        raise ValueError(f'the reducing end of {text} is linked to position {acceptor}, not to ASN, '
+                         f'e.g. GlcNAc(b1- or GlcNAc')
+    node = GlycanNode(text[name_start:start], anomer, int(donor), int(acceptor) if acceptor else None)
+    return node, name_start
+
+
+def _parse_chain(text, end, reducing_end=False):
+    '''Parses the chain ending at text[end] from right to left, up to the start of the string
+    or the opening bracket of the branch it belongs to. returns its first residue and the position reached.'''
+    first = None
+    parent = None
+    pos = end
+    while True:
+        node, pos = _parse_residue(text, pos, reducing_end and first is None)
+        if parent is None:
+            first = node
+        else:
+            node.parent = parent
+            parent.children.insert(0, node)
+
+        branches = []
+        while pos > 0 and text[pos - 1] == ']':
+            branch, pos = _parse_chain(text, pos - 1)
+            if pos == 0 or text[pos - 1] != '[':
+                raise ValueError(f'unbalanced "]" in {text}')
+            pos -= 1
+            branch.parent = node
+            branches.append(branch)
+        node.children.extend(reversed(branches))
+
+        if pos == 0 or text[pos - 1] == '[':
+            return first, pos
+        parent = node
+
+
+@profiling.timed('parse')
+def parse_iupac(iupac):
+    '''Parses a condensed IUPAC string, e.g. Gal(b1-3)GlcNAc(b1-2)Man(a1-3)[...]Man(b1-4)GlcNAc(b1-4)GlcNAc(b1-,
+    into a GlycanTree in a single right-to-left pass. Any number of branches and any nesting depth are supported.'''
+    text = ''.join(iupac.split())
+    if not text:
+        raise ValueError('empty IUPAC string')
+    root, pos = _parse_chain(text, len(text), reducing_end=True)
+    if pos != 0:
+        raise ValueError(f'unbalanced "[" in {text}')
+    return GlycanTree(root)
+
+
+def tree_structure_mapping(iupac_string, glysites):
+    '''{chain: IUPAC}, glysites -> {chain: structure mapping DataFrame}, the output of
+    GlycanAnalyzer.structure_mapping derived from the glycan trees.'''
+    return {k: parse_iupac(iupac_string[k]).structure_mapping(g) for k, g in zip(iupac_string, glysites)}
+
+
+def tree_triplet_dict(iupac_string, glysites):
+    '''{chain: IUPAC}, glysites -> {chain: triplets}, the maincore_dict after GlycanAnalyzer.branch_processing.'''
+    return {k: parse_iupac(iupac_string[k]).triplets(g) for k, g in zip(iupac_string, glysites)}
@@ -0,0 +1,24 @@
+import sys
+import importlib.util
+
+
+def lazy_import(name):
+    '''returns module name without executing it, it is imported on first attribute access,
+    e.g. pd = lazy_import('pandas') costs nothing until pd.DataFrame is used.
+    Modules that are already imported are returned as they are.'''
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f'No module named {name!r}')
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def is_available(name):
+    '''True if module name can be imported, without importing it.'''
+    return name in sys.modules or importlib.util.find_spec(name) is not None
@@ -0,0 +1,122 @@
+import os
+import hashlib
+import tempfile
+from collections import OrderedDict
+from iupac_to_mapping import glycan_tree
+from iupac_to_mapping import lazy
+
+pd = lazy.lazy_import('pandas')
+
+# glycosylation site used while parsing, the cached mappings are site independent
+# and the real site is filled into the protein-glycan row on every lookup
+PLACEHOLDER_SITE = 10
+
+
+def normalize_iupac(iupac):
+    '''Normalized form of an IUPAC string used as cache key: surrounding and internal whitespace removed.'''
+    return ''.join(iupac.split())
+
+
+def iupac_key(iupac):
+    '''Content address of an IUPAC string, sha256 of its normalized form.'''
+    return hashlib.sha256(normalize_iupac(iupac).encode()).hexdigest()
+
+
+def parse_structure_mapping(iupac, site=PLACEHOLDER_SITE):
+    '''Parses a single glycan into its structure mapping DataFrame through its GlycanTree.'''
+    return glycan_tree.parse_iupac(iupac).structure_mapping(site)
+
+
+class MappingCache:
+    '''Content-addressed cache of IUPAC string -> structure mapping DataFrame.
+
+    maxsize: number of mappings kept in memory, least recently used ones are evicted first
+    cache_dir: optional directory in which every parsed mapping is also stored as <key>.pkl,
+    it is looked up on a memory miss and survives between sessions'''
+    def __init__(self, maxsize=1024, cache_dir=None):
+        self.maxsize = maxsize
+        self.cache_dir = cache_dir
+        self.mappings = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def __len__(self):
+        return len(self.mappings)
+
+    def __contains__(self, iupac):
+        return iupac_key(iupac) in self.mappings
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.pkl')
+
+    def _remember(self, key, mapping):
+        self.mappings[key] = mapping
+        self.mappings.move_to_end(key)
+        while len(self.mappings) > self.maxsize:
+            self.mappings.popitem(last=False)
+
+    def get(self, iupac):
+        '''returns the cached site independent mapping of iupac, or None.'''
+        key = iupac_key(iupac)
+        if key in self.mappings:
+            self.mappings.move_to_end(key)
+            self.hits += 1
+            return self.mappings[key]
+
+        if self.cache_dir is not None and os.path.exists(self._disk_path(key)):
+            try:
+                mapping = pd.read_pickle(self._disk_path(key))
+            except Exception:
+                # an unreadable entry, e.g. truncated by a killed job, counts as a miss and is written again
+                mapping = None
+            if mapping is not None:
+                self._remember(key, mapping)
+                self.hits += 1
+                return mapping
+
+        self.misses += 1
+        return None
+
+    def put(self, iupac, mapping):
+        key = iupac_key(iupac)
+        self._remember(key, mapping)
+        if self.cache_dir is not None:
+            # written under a temporary name first, jobs sharing cache_dir never read a partial file
+            fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+            os.close(fd)
+            try:
+                mapping.to_pickle(tmp)
+                os.replace(tmp, self._disk_path(key))
+            except BaseException:
+                os.remove(tmp)
+                raise
+
+    def clear(self):
+        '''Empties the in-memory cache, the on-disk store is kept.'''
+        self.mappings.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def structure_mapping(self, iupac, site):
+        '''returns the structure mapping DataFrame of iupac attached to ASN site, parsing it only on a miss.'''
+        mapping = self.get(iupac)
+        if mapping is None:
+            mapping = parse_structure_mapping(iupac)
+            self.put(iupac, mapping)
+
+        mapping = mapping.copy()
+        mapping.iloc[0, mapping.columns.get_loc('index1')] = str(site)
+        return mapping
+
+
+default_cache = MappingCache()
+
+
+def cached_structure_mapping(iupac_string, glysites, cache=None):
+    '''Drop-in for the GlycanProcessor -> GlycanAnalyzer.structure_mapping pipeline,
+    iupac_string: {chain: IUPAC}, glysites: list of ASN resids.
+    returns {chain: structure mapping DataFrame}, glycans already seen are not parsed again.'''
+    cache = default_cache if cache is None else cache
+    return {k: cache.structure_mapping(iupac_string[k], g) for k, g in zip(iupac_string, glysites)}
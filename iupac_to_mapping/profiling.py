@@ -0,0 +1,152 @@
+import io
+import json
+import pstats
+import cProfile
+from time import perf_counter
+from functools import wraps
+from contextlib import contextmanager
+
+# stages timed by the pipeline, in pipeline order
+STAGES = ('parse', 'mapping', 'index_discovery', 'plan_build', 'trajectory_io', 'kernel')
+
+
+class Profiler:
+    '''Per-stage wall time and counters of a run, cheap enough to stay on all the time.
+
+    Stages, one of STAGES, accumulate the seconds and number of calls of stage(name) blocks or timed
+    functions, nested stages are inclusive. Counters accumulate counts such as frames and dihedrals.
+    profile: None, 'cprofile' or 'pyinstrument', a full profiler run between start and stop,
+    its text report is included in report().'''
+    def __init__(self, profile=None):
+        self.profile = profile
+        self._profiler = None
+        self.reset()
+
+    def reset(self):
+        self.stages = {}
+        self.counters = {}
+        self.profile_report = None
+        self.started = perf_counter()
+
+    def add_time(self, name, seconds, calls=1):
+        if name not in STAGES:
+            raise ValueError(f'unknown stage {name!r}, expected one of {", ".join(STAGES)}')
+        stage = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0})
+        stage['seconds'] += seconds
+        stage['calls'] += calls
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + int(n)
+
+    @contextmanager
+    def stage(self, name):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, perf_counter() - start)
+
+    def merge(self, report):
+        '''Adds the stages and counters of a report, e.g. from a worker process.'''
+        for name, stage in report.get('stages', {}).items():
+            self.add_time(name, stage['seconds'], stage['calls'])
+        for name, n in report.get('counters', {}).items():
+            self.count(name, n)
+
+    def start(self):
+        '''Starts the optional cProfile or pyinstrument run.'''
+        if self.profile == 'cprofile':
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        elif self.profile == 'pyinstrument':
+            try:
+                import pyinstrument
+            except ImportError:
+                raise ImportError('profile="pyinstrument" needs the pyinstrument package') from None
+            self._profiler = pyinstrument.Profiler()
+            self._profiler.start()
+        elif self.profile is not None:
+            raise ValueError(f"profile must be None, 'cprofile' or 'pyinstrument', not {self.profile!r}")
+
+    def stop(self, n_functions=30):
+        '''Stops the profiler run and keeps its report of the n_functions most expensive functions.'''
+        if self._profiler is None:
+            return
+        if self.profile == 'cprofile':
+            self._profiler.disable()
+            text = io.StringIO()
+            pstats.Stats(self._profiler, stream=text).sort_stats('cumulative').print_stats(n_functions)
+            self.profile_report = text.getvalue()
+        else:
+            self._profiler.stop()
+            self.profile_report = self._profiler.output_text()
+        self._profiler = None
+
+    def report(self):
+        '''returns the stages, counters and wall time as a JSON-serializable dict.'''
+        order = {name: i for i, name in enumerate(STAGES)}
+        stages = dict(sorted(self.stages.items(), key=lambda item: (order.get(item[0], len(order)), item[0])))
+        report = {'wall_seconds': perf_counter() - self.started, 'stages': stages, 'counters': dict(self.counters)}
+        frames = self.counters.get('frames')
+        io_kernel = sum(stages.get(name, {}).get('seconds', 0.0) for name in ('trajectory_io', 'kernel'))
+        if frames and io_kernel:
+            report['frames_per_sec'] = frames / io_kernel
+        if self.profile_report is not None:
+            report['profile'] = {'profiler': self.profile, 'text': self.profile_report}
+        return report
+
+    def write_report(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=1)
+
+    def print_report(self):
+        report = self.report()
+        print(f"Total execution time: {report['wall_seconds']:.2f} secs")
+        for name, stage in report['stages'].items():
+            print(f"  {name:<40} {stage['seconds']:10.3f} secs {stage['calls']:8d} calls")
+        for name, n in report['counters'].items():
+            print(f'  {name:<40} {n:10d}')
+
+
+# the profiler all instrumented functions report to
+profiler = Profiler()
+
+
+def stage(name):
+    return profiler.stage(name)
+
+
+def count(name, n=1):
+    profiler.count(name, n)
+
+
+def timed(name):
+    '''Decorator recording the calls of a function as stage name of the profiler.'''
+    def decorator(func):
+        @wraps(func)
+        def _timed(*args, **kwargs):
+            with profiler.stage(name):
+                return func(*args, **kwargs)
+        return _timed
+    return decorator
+
+
+@contextmanager
+def run(report_path=None, profile=None, verbose=False):
+    '''Profiles everything in the with block: resets the stages and counters, runs the optional
+    cProfile/pyinstrument profiler and writes the JSON report to report_path at the end.
+
+        with profiling.run('report.json', profile='cprofile') as prof:
+            torsions.all_torsions(traj)
+        prof.report()'''
+    profiler.reset()
+    profiler.profile = profile
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        if report_path is not None:
+            profiler.write_report(report_path)
+        if verbose:
+            profiler.print_report()
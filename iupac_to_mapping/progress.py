@@ -0,0 +1,119 @@
+import os
+import sys
+import json
+import logging
+from time import time, perf_counter
+
+# structured progress events, one JSON object per log record
+logger = logging.getLogger('iupac_to_mapping.progress')
+
+
+def rss_bytes():
+    '''returns the resident memory of this process in bytes, or None if it cannot be read.'''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # peak instead of current resident memory, in kB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def print_progress(event, stream=None):
+    '''Progress bar callback, rewrites one line on stderr.'''
+    stream = stream or sys.stderr
+    total = event['total']
+    if total:
+        filled = int(30 * event['frames'] / total)
+        bar = f"|{'#' * filled}{' ' * (30 - filled)}| {event['frames']}/{total}"
+    else:
+        bar = f"{event['frames']} frames"
+    eta = '?' if event['eta_seconds'] is None else f"{event['eta_seconds']:.0f}s"
+    rss = '?' if event['rss_bytes'] is None else f"{event['rss_bytes'] / 2 ** 20:.0f} MiB"
+    stream.write(f"\r{event['desc']} {bar} {event['frames_per_sec']:.1f} frames/s ETA {eta} RSS {rss}")
+    if event['event'] == 'done':
+        stream.write('\n')
+    stream.flush()
+
+
+def print_replica_progress(event, stream=None):
+    '''Progress callback of EnsembleRunner, one line on stderr per finished or failed replica.'''
+    if event['event'] == 'done':
+        return
+    stream = stream or sys.stderr
+    head = f"[{event['replicas_done']}/{event['replicas_total']}] replica {event['replica']} ({event['trajectory']})"
+    if event['status'] == 'failed':
+        stream.write(f"{head} failed: {event['error']}\n")
+    else:
+        eta = '?' if event['eta_seconds'] is None else f"{event['eta_seconds']:.0f} secs"
+        stream.write(f"{head}: {event['replica_frames']} frames in {event['replica_seconds']:.1f} secs, "
+                     f"{event['frames_per_sec']:.1f} frames/sec overall, ETA {eta}\n")
+    stream.flush()
+
+
+class Progress:
+    '''Tracks the frames processed of a run and reports frames, frames/sec, ETA and RSS.
+
+    total: number of frames of the run, None if unknown (no ETA then)
+    callback: called with each event dict, e.g. print_progress
+    interval: minimum seconds between two events, the final 'done' event is always sent
+    Every event is also logged as JSON to the iupac_to_mapping.progress logger at INFO level.'''
+    def __init__(self, total=None, callback=None, desc='torsions', interval=1.0):
+        self.total = total
+        self.callback = callback
+        self.desc = desc
+        self.interval = interval
+        self.frames = 0
+        self.started = perf_counter()
+        self.last_event = None
+        self.closed = False
+
+    def event(self, name='progress', **fields):
+        elapsed = perf_counter() - self.started
+        rate = self.frames / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if self.total is not None and rate > 0:
+            eta = max(self.total - self.frames, 0) / rate
+        event = {'event': name, 'desc': self.desc, 'frames': self.frames, 'total': self.total,
+                 'elapsed_seconds': elapsed, 'frames_per_sec': rate, 'eta_seconds': eta,
+                 'rss_bytes': rss_bytes(), 'time': time()}
+        event.update(fields)
+        return event
+
+    def emit(self, event):
+        self.last_event = perf_counter()
+        if self.callback is not None:
+            self.callback(event)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps(event))
+
+    def update(self, n=1, **fields):
+        '''Adds n processed frames, an event is sent if interval seconds passed since the last one.
+        Keyword arguments are added to the event.'''
+        self.frames += n
+        if self.last_event is None or perf_counter() - self.last_event >= self.interval:
+            self.emit(self.event(**fields))
+
+    def close(self, **fields):
+        '''Sends the final 'done' event, once.'''
+        if not self.closed:
+            self.closed = True
+            self.emit(self.event('done', **fields))
+
+
+def make_progress(progress, total=None, desc='torsions'):
+    '''returns the Progress of a run from the progress argument of the torsion functions:
+    None or False only logs events, True prints a progress bar, a callable is called with every
+    event, and a Progress is used as it is.'''
+    if isinstance(progress, Progress):
+        return progress
+    if progress is True:
+        return Progress(total, print_progress, desc)
+    if callable(progress):
+        return Progress(total, progress, desc)
+    return Progress(total, None, desc)
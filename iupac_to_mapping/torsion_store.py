@@ -0,0 +1,339 @@
+import os
+import json
+import struct
+import hashlib
+import numpy as np
+from iupac_to_mapping import lazy
+
+pd = lazy.lazy_import('pandas')
+
+
+# spare digits for the first axis in the header of .npy files created here, so the header keeps its
+# length while rows are appended, whichever numpy version wrote or reads the file
+GROWTH_AXIS_DIGITS = 21
+
+
+def _npy_header(shape, fortran_order, dtype, header_length=None, version=(1, 0)):
+    '''returns the .npy header of an array with the given shape, with spare space for the first axis
+    to grow, or padded to header_length bytes to replace the header of an existing file.'''
+    header = repr({'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)), 'fortran_order': fortran_order,
+                   'shape': tuple(int(n) for n in shape)})
+    size_format = '<H' if version == (1, 0) else '<I'
+    prefix = len(np.lib.format.magic(*version)) + struct.calcsize(size_format)
+    if header_length is None:
+        header_length = prefix + len(header) + GROWTH_AXIS_DIGITS - len(str(shape[0])) + 1
+        header_length += -header_length % 64
+    if prefix + len(header) + 1 > header_length:
+        raise RuntimeError(f'.npy header of shape {tuple(shape)} does not fit in {header_length} bytes')
+    padded = header.ljust(header_length - prefix - 1) + '\n'
+    return np.lib.format.magic(*version) + struct.pack(size_format, len(padded)) + padded.encode('latin1')
+
+
+def _read_npy_header(fp):
+    '''returns the format version, shape, fortran_order and dtype of the open .npy file fp,
+    which is left at the start of the data.'''
+    version = np.lib.format.read_magic(fp)
+    if version == (1, 0):
+        return (version,) + np.lib.format.read_array_header_1_0(fp)
+    return (version,) + np.lib.format.read_array_header_2_0(fp)
+
+
+def _write_npy_header(fp, header_length, version, shape, fortran_order, dtype):
+    '''Rewrites the header of the open .npy file fp with a new shape, keeping its length.'''
+    fp.seek(0)
+    fp.write(_npy_header(shape, fortran_order, dtype, header_length, version))
+
+
+class NpyChunkWriter:
+    '''Appends (n_frames x n_dihedrals) torsion chunks to a .npy file as they are produced,
+    so only one chunk is held in memory at a time.
+
+    The header is rewritten with the current number of frames after each chunk, the file is
+    a regular .npy file that can be read back with np.load(path, mmap_mode='r').'''
+    def __init__(self, path, n_columns, dtype=np.float32):
+        self.path = path
+        self.n_columns = n_columns
+        self.dtype = np.dtype(dtype)
+        self.n_frames = 0
+        self.fp = open(path, 'wb')
+        self.fp.write(_npy_header((0, n_columns), False, self.dtype))
+        self.header_length = self.fp.tell()
+
+    def append(self, angles, frames=None, times=None):
+        '''Appends an (n_frames x n_columns) chunk, frames and times are not stored in this format.'''
+        angles = np.ascontiguousarray(angles, dtype=self.dtype)
+        if angles.ndim != 2 or angles.shape[1] != self.n_columns:
+            raise ValueError(f'expected a chunk with {self.n_columns} columns, got shape {angles.shape}')
+
+        self.fp.seek(0, 2)
+        self.fp.write(angles.tobytes())
+        self.n_frames += len(angles)
+        _write_npy_header(self.fp, self.header_length, (1, 0), (self.n_frames, self.n_columns), False, self.dtype)
+        self.fp.flush()
+
+    def close(self):
+        if not self.fp.closed:
+            self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _write_json(path, data):
+    # written to a temporary file first, an interrupted job never leaves a truncated file
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f, indent=1)
+    os.replace(path + '.tmp', path)
+
+
+def frame_selection(frames):
+    '''returns the frame selection recorded in the metadata of a store: the start, stop and step of a slice
+    (None is all frames), or the number and sha256 of an array of frame numbers.'''
+    if frames is None or isinstance(frames, slice):
+        frames = frames or slice(None)
+        return {'start': frames.start, 'stop': frames.stop, 'step': frames.step}
+    frames = np.ascontiguousarray(frames, dtype=np.int64)
+    return {'n_frames': len(frames), 'sha256': hashlib.sha256(frames.tobytes()).hexdigest()}
+
+
+def append_npy(path, values):
+    '''Appends values along the first axis of the .npy file at path, creating it if needed.'''
+    values = np.ascontiguousarray(values)
+    if not os.path.exists(path):
+        with open(path, 'wb') as fp:
+            fp.write(_npy_header(values.shape, False, values.dtype))
+            fp.write(values.tobytes())
+        return
+
+    with open(path, 'r+b') as fp:
+        version, shape, fortran_order, dtype = _read_npy_header(fp)
+        header_length = fp.tell()
+        if dtype != values.dtype or shape[1:] != values.shape[1:]:
+            raise ValueError(f'cannot append {values.dtype} {values.shape} to {dtype} {shape} in {path}')
+
+        fp.seek(0, 2)
+        fp.write(values.tobytes())
+        _write_npy_header(fp, header_length, version, (shape[0] + len(values),) + tuple(shape[1:]), fortran_order,
+                          dtype)
+
+
+def truncate_npy(path, n_rows):
+    '''Drops the rows after the first n_rows of the .npy file at path, if it has more.'''
+    if not os.path.exists(path):
+        return
+    with open(path, 'r+b') as fp:
+        version, shape, fortran_order, dtype = _read_npy_header(fp)
+        if shape[0] <= n_rows:
+            return
+        header_length = fp.tell()
+        _write_npy_header(fp, header_length, version, (n_rows,) + tuple(shape[1:]), fortran_order, dtype)
+        fp.truncate(header_length + n_rows * dtype.itemsize * int(np.prod(shape[1:])))
+
+
+class TorsionStore:
+    '''Columnar on-disk torsion store.
+
+    A directory holding one .npy file per (chain, linkage, torsion) column, the frame numbers
+    (frame.npy) and times (time.npy) and a metadata.json with the column labels, the source
+    files and the structure_mapping the torsions were computed from. Stores of an ensemble
+    also hold the replica number of every row (replica.npy).
+    Columns are read memory-mapped, so selecting one linkage never loads the rest of the table.
+
+    Every appended chunk is a checkpoint: manifest.json records the number of committed rows and
+    the frame range (and replica) of every block written, after all files of the block are written,
+    and the replicas of an ensemble written completely.
+    Rows beyond the committed ones, left by a run interrupted in the middle of append, are never
+    read and are dropped when the store is reopened with resume=True.'''
+    metadata_file = 'metadata.json'
+    manifest_file = 'manifest.json'
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, self.metadata_file)) as f:
+            self.metadata = json.load(f)
+        self.columns = pd.MultiIndex.from_tuples([tuple(c) for c in self.metadata['columns']],
+                                                 names=self.metadata['column_names'])
+        manifest = os.path.join(path, self.manifest_file)
+        if os.path.exists(manifest):
+            with open(manifest) as f:
+                self.manifest = json.load(f)
+        else:
+            # store written without checkpoints, all rows on disk count as committed
+            frames = os.path.join(path, 'frame.npy')
+            rows = len(np.load(frames, mmap_mode='r')) if os.path.exists(frames) else 0
+            self.manifest = {'rows': rows, 'blocks': []}
+
+    @classmethod
+    def create(cls, path, columns, structure_mapping=None, source=None, dtype=np.float32, plan_hash=None,
+               resume=False, frames=None):
+        '''Creates an empty store at path.
+        columns: MultiIndex of (chain, linkage, torsion) labels
+        structure_mapping: {chain: DataFrame} from GlycanAnalyzer.structure_mapping, kept as provenance
+        source: dict with information on the input files
+        plan_hash: DihedralPlan.checksum() of the plan the columns are computed with
+        resume: reopen the store if path already holds one, to continue an interrupted run, instead of
+        raising FileExistsError. Its columns, dtype, plan_hash and frame selection must match.
+        frames: frame_selection() of the frames the store is written with'''
+        os.makedirs(path, exist_ok=True)
+        if os.path.exists(os.path.join(path, cls.metadata_file)):
+            if not resume:
+                raise FileExistsError(f'{path} already contains a torsion store')
+            store = cls(path)
+            store.check_plan(columns, dtype, plan_hash)
+            store.check_frames(frames)
+            store.rollback()
+            return store
+
+        metadata = {'columns': [list(c) for c in columns],
+                    'column_names': list(columns.names),
+                    'dtype': np.dtype(dtype).str,
+                    'plan_hash': plan_hash,
+                    'frame_selection': frames,
+                    'source': source or {},
+                    'structure_mapping': {k: v.astype(str).to_dict(orient='list')
+                                          for k, v in (structure_mapping or {}).items()}}
+        # metadata.json marks an existing store, it is written last
+        _write_json(os.path.join(path, cls.manifest_file), {'rows': 0, 'blocks': []})
+        _write_json(os.path.join(path, cls.metadata_file), metadata)
+        return cls(path)
+
+    def check_plan(self, columns, dtype=np.float32, plan_hash=None):
+        '''Raises ValueError if the store was not written with the given columns, dtype and plan_hash.'''
+        if [list(c) for c in columns] != self.metadata['columns'] or np.dtype(dtype).str != self.metadata['dtype']:
+            raise ValueError(f'{self.path} holds other torsion columns or another dtype')
+        if plan_hash is not None and self.metadata.get('plan_hash') != plan_hash:
+            raise ValueError(f'{self.path} was written with a different dihedral plan')
+
+    def check_frames(self, frames):
+        '''Raises ValueError if the store was not written with the frame selection frames (see frame_selection).'''
+        if frames is not None and self.metadata.get('frame_selection') != frames:
+            raise ValueError(f'{self.path} was written with a different frame selection')
+
+    def rollback(self):
+        '''Drops the rows written after the last committed block, e.g. by a run interrupted in append.'''
+        for name in os.listdir(self.path):
+            if name.endswith('.npy'):
+                truncate_npy(os.path.join(self.path, name), self.manifest['rows'])
+
+    def _column_file(self, i):
+        return os.path.join(self.path, f'col{i:06d}.npy')
+
+    def append(self, angles, frames, times=None, replica=None):
+        '''Appends an (n_frames x n_columns) chunk with the frame numbers and times of its rows,
+        and the replica they belong to for ensemble stores, and commits it as a block in the manifest.'''
+        angles = np.asarray(angles, dtype=self.metadata['dtype'])
+        if angles.ndim != 2 or angles.shape[1] != len(self.columns):
+            raise ValueError(f'expected a chunk with {len(self.columns)} columns, got shape {angles.shape}')
+        if (replica is not None) != self.has_replicas and len(self):
+            raise ValueError('either all or none of the chunks of a store belong to a replica')
+        if len(angles) == 0:
+            return
+        if times is None:
+            times = np.full(len(angles), np.nan)
+
+        for i in range(len(self.columns)):
+            append_npy(self._column_file(i), angles[:, i])
+        append_npy(os.path.join(self.path, 'time.npy'), np.asarray(times, dtype=np.float64))
+        append_npy(os.path.join(self.path, 'frame.npy'), np.asarray(frames, dtype=np.int64))
+        if replica is not None:
+            append_npy(os.path.join(self.path, 'replica.npy'), np.full(len(angles), replica, dtype=np.int32))
+
+        block = {'first_frame': int(frames[0]), 'last_frame': int(frames[-1]), 'n_frames': len(angles)}
+        if replica is not None:
+            block['replica'] = int(replica)
+        self.manifest['rows'] += len(angles)
+        self.manifest['blocks'].append(block)
+        _write_json(os.path.join(self.path, self.manifest_file), self.manifest)
+
+    def __len__(self):
+        return self.manifest['rows']
+
+    @property
+    def blocks(self):
+        '''returns the committed blocks, dicts with first_frame, last_frame, n_frames and replica.'''
+        return self.manifest['blocks']
+
+    @property
+    def done_replicas(self):
+        '''returns the replicas all of whose blocks are in the store, see commit_replica.'''
+        return self.manifest.get('replicas', [])
+
+    def commit_replica(self, replica):
+        '''Records in the manifest that all blocks of replica are written.'''
+        self.manifest.setdefault('replicas', []).append(int(replica))
+        _write_json(os.path.join(self.path, self.manifest_file), self.manifest)
+
+    def done_frames(self, replica=None):
+        '''returns the frame numbers already in the store, of one replica if given.'''
+        if replica is None:
+            return np.asarray(self.frames)
+        return np.asarray(self.frames)[np.asarray(self.replicas) == replica]
+
+    @property
+    def frames(self):
+        return self._load(os.path.join(self.path, 'frame.npy'), np.int64)
+
+    @property
+    def times(self):
+        return self._load(os.path.join(self.path, 'time.npy'), np.float64)
+
+    @property
+    def has_replicas(self):
+        return os.path.exists(os.path.join(self.path, 'replica.npy'))
+
+    @property
+    def replicas(self):
+        return self._load(os.path.join(self.path, 'replica.npy'), np.int32)
+
+    def _load(self, path, dtype):
+        if not os.path.exists(path):
+            return np.empty(0, dtype=dtype)
+        return np.load(path, mmap_mode='r')[:self.manifest['rows']]
+
+    def select(self, chain=None, linkage=None, torsion=None):
+        '''returns the positions of the columns matching the given labels (None matches everything).'''
+        mask = np.ones(len(self.columns), dtype=bool)
+        for level, value in zip(self.columns.names, (chain, linkage, torsion)):
+            if value is not None:
+                values = [value] if isinstance(value, str) else list(value)
+                mask &= self.columns.get_level_values(level).isin(values)
+        return np.flatnonzero(mask)
+
+    def column(self, chain, linkage, torsion):
+        '''returns the memory-mapped time series of a single column.'''
+        i = self.select(chain, linkage, torsion)
+        if len(i) != 1:
+            raise KeyError((chain, linkage, torsion))
+        return self._load(self._column_file(i[0]), self.metadata['dtype'])
+
+    def read(self, chain=None, linkage=None, torsion=None, frames=slice(None), replica=None):
+        '''returns a DataFrame with only the selected columns and rows loaded, indexed by frame,
+        or by (replica, frame) for ensemble stores. frames selects rows by position, within the
+        rows of replica if one is given.'''
+        rows = frames
+        if replica is not None:
+            rows = np.flatnonzero(np.asarray(self.replicas) == replica)[frames]
+
+        selected = self.select(chain, linkage, torsion)
+        data = {self.columns[i]: self._load(self._column_file(i), self.metadata['dtype'])[rows] for i in selected}
+        if self.has_replicas:
+            index = pd.MultiIndex.from_arrays([self.replicas[rows], self.frames[rows]], names=['replica', 'frame'])
+        else:
+            index = pd.Index(self.frames[rows], name='frame')
+        return pd.DataFrame(data, index=index, columns=self.columns[selected])
+
+    @property
+    def complete(self):
+        '''True once the run writing the store marked it as finished.'''
+        return self.metadata.get('complete', False)
+
+    def mark_complete(self):
+        self.metadata['complete'] = True
+        _write_json(os.path.join(self.path, self.metadata_file), self.metadata)
+
+    def structure_mapping(self):
+        '''returns the {chain: DataFrame} structure mapping the torsions were computed from.'''
+        return {k: pd.DataFrame(v) for k, v in self.metadata['structure_mapping'].items()}
@@ -0,0 +1,69 @@
+'''Regression tests of the IUPAC parser against the structure mappings of the five AGP glycans of
+test_glycans.ipynb, as produced by the original regex/branch pipeline (data/agp_structure_mapping.json).'''
+import os
+import json
+import pytest
+from iupac_to_mapping import glycan_tree
+from iupac_to_mapping import string_process
+from iupac_to_mapping import iupac_converter
+
+IUPAC_STRING = {
+    'chain I': "Gal(b1-3)GlcNAc(b1-2)Man(a1-3)[Gal(b1-3)GlcNAc(b1-2)Man(a1-6)]Man(b1-4)GlcNAc(b1-4)GlcNAc(b1-",
+    'chain II': "Neu5Ac(a2-3)Gal(b1-4)GlcNAc(b1-2)Man(a1-3)[Neu5Ac(a2-3)Gal(b1-4)GlcNAc(b1-2)Man(a1-6)]"
+                "Man(b1-4)GlcNAc(b1-4)GlcNAc(b1-",
+    'chain III': "Gal(b1-4)GlcNAc(b1-2)[Gal(b1-4)GlcNAc(b1-4)]Man(a1-3)[Gal(b1-3)GlcNAc(b1-2)Man(a1-6)]"
+                 "Man(b1-4)GlcNAc(b1-4)GlcNAc(b1-",
+    'chain IV': "Neu5Ac(a2-3)Gal(b1-4)GlcNAc(b1-2)[Neu5Ac(a2-6)Gal(b1-4)GlcNAc(b1-6)]Man(a1-3)"
+                "[Neu5Ac(a2-6)Gal(b1-4)GlcNAc(b1-2)[Neu5Ac(a2-3)Gal(b1-4)GlcNAc(b1-4)]Man(a1-6)]"
+                "Man(b1-4)GlcNAc(b1-4)GlcNAc(b1-",
+    'chain V': "Neu5Ac(a2-3)Gal(b1-4)GlcNAc(b1-4)Man(a1-3)[Neu5Ac(a2-3)Gal(b1-4)GlcNAc(b1-2)"
+               "[Neu5Ac(a2-3)Gal(b1-4)GlcNAc(b1-6)]Man(a1-6)]Man(b1-4)GlcNAc(b1-4)[D-Fuc(a1-6)]GlcNAc(b1-"}
+GLYSITES = [15, 38, 54, 75, 85]
+
+with open(os.path.join(os.path.dirname(__file__), 'data', 'agp_structure_mapping.json')) as f:
+    BASELINE = json.load(f)
+
+
+def check_mapping(mapping):
+    assert list(mapping) == list(BASELINE)
+    for chain, expected in BASELINE.items():
+        assert list(mapping[chain].columns) == expected['columns']
+        assert list(mapping[chain].index) == list(range(len(expected['rows'])))
+        assert mapping[chain].astype(str).values.tolist() == expected['rows']
+
+
+def test_tree_structure_mapping():
+    check_mapping(glycan_tree.tree_structure_mapping(IUPAC_STRING, GLYSITES))
+
+
+def test_tree_triplet_dict():
+    triplets = glycan_tree.tree_triplet_dict(IUPAC_STRING, GLYSITES)
+    assert triplets == {chain: expected['triplets'] for chain, expected in BASELINE.items()}
+
+
+def test_notebook_pipeline():
+    processor = string_process.GlycanProcessor(IUPAC_STRING, GLYSITES)
+    glycan_format_dict = processor.process_glycan()
+    core = processor.core_triplet_dict(glycan_format_dict)
+    analyzer = iupac_converter.GlycanAnalyzer(glycan_format_dict, core, processor)
+    analyzer.branch_processing()
+    assert core == {chain: expected['triplets'] for chain, expected in BASELINE.items()}
+    check_mapping(analyzer.structure_mapping())
+
+
+def test_free_reducing_end():
+    bare = glycan_tree.parse_iupac(IUPAC_STRING['chain V'][:-len('(b1-')])
+    assert bare.triplets(85) == BASELINE['chain V']['triplets']
+
+
+@pytest.mark.parametrize('iupac', ['Gal(b1-3)GlcNAc(b1-4)', 'Man(b1-4)GlcNAc(b1-4)GlcNAc(b1-4', 'Man(b1-4]', ''])
+def test_invalid_reducing_end(iupac):
+    with pytest.raises(ValueError):
+        glycan_tree.parse_iupac(iupac)
+
+
+def test_unknown_anomer():
+    tree = glycan_tree.parse_iupac('Man(?1-4)GlcNAc(b1-4)GlcNAc(b1-')
+    assert tree.triplets(15)[2] == ['?-Man3', '1-4', 'B-GlcNAc2']
+    with pytest.raises(ValueError):
+        tree.structure_mapping(15)
@@ -0,0 +1,31 @@
+'''Tests of resuming a TorsionStore, which must have been written with the same columns, plan and frames.'''
+import numpy as np
+import pandas as pd
+import pytest
+from iupac_to_mapping import torsion_store
+
+COLUMNS = pd.MultiIndex.from_tuples([('chain I', '1-4', 'phi'), ('chain I', '1-4', 'psi')],
+                                    names=['chain', 'linkage', 'torsion'])
+
+
+def test_frame_selection():
+    assert torsion_store.frame_selection(None) == torsion_store.frame_selection(slice(None))
+    assert torsion_store.frame_selection(np.arange(10)) == torsion_store.frame_selection(list(range(10)))
+    assert torsion_store.frame_selection(np.arange(10)) != torsion_store.frame_selection(np.arange(1, 11))
+
+
+def test_resume_same_frames(tmp_path):
+    frames = torsion_store.frame_selection(np.arange(0, 100, 10))
+    store = torsion_store.TorsionStore.create(str(tmp_path), COLUMNS, plan_hash='plan', frames=frames)
+    store.append(np.zeros((5, 2)), np.arange(0, 50, 10))
+    store = torsion_store.TorsionStore.create(str(tmp_path), COLUMNS, plan_hash='plan', resume=True, frames=frames)
+    assert store.done_frames().tolist() == [0, 10, 20, 30, 40]
+
+
+@pytest.mark.parametrize('frames', [np.arange(0, 100, 5), slice(0, 100, 10)])
+def test_resume_other_frames(tmp_path, frames):
+    torsion_store.TorsionStore.create(str(tmp_path), COLUMNS, plan_hash='plan',
+                                      frames=torsion_store.frame_selection(np.arange(0, 100, 10)))
+    with pytest.raises(ValueError, match='frame selection'):
+        torsion_store.TorsionStore.create(str(tmp_path), COLUMNS, plan_hash='plan', resume=True,
+                                          frames=torsion_store.frame_selection(frames))